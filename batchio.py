@@ -0,0 +1,161 @@
+import socket
+import struct
+from typing import Any, List, Optional, Tuple
+
+# Linux UDP socket options (include/uapi/linux/udp.h). Python only
+# exposes them as constants on some builds.
+SOL_UDP = getattr(socket, "SOL_UDP", 17)
+UDP_SEGMENT = getattr(socket, "UDP_SEGMENT", 103)
+UDP_GRO = getattr(socket, "UDP_GRO", 104)
+
+# Limits of one UDP GSO send: the kernel accepts at most 64 segments and
+# the whole buffer has to fit in one (64 KB) UDP datagram
+max_gso_segments = 64
+max_gso_bytes = 65507
+# Largest buffer one receive call can return: with GRO, one read returns
+# a run of coalesced datagrams, up to the largest possible UDP datagram.
+max_read_size = 65535
+# Socket receive buffer requested when batching, so that a whole burst
+# can queue up while the previous batch is processed
+receive_buffer_size = 1 << 22
+
+
+class BatchSender:
+    '''Queues outgoing datagrams and sends them with as few system calls as
+    possible.
+
+    `flush` sends each run of datagrams that go to the same address and
+    have the same size (the last one may be shorter) with a single
+    `sendmsg` using UDP generic segmentation offload (`UDP_SEGMENT`): the
+    kernel cuts the buffer back into the original datagrams. Where GSO
+    is not supported, every datagram is sent on its own, as before.
+
+    '''
+
+    def __init__(self, sock: socket.socket, gso: bool = True):
+        self.socket = sock
+        self.gso = gso and hasattr(socket, "CMSG_SPACE")
+        self.queue: List[Tuple[bytes, Any]] = []
+        self.syscalls = 0
+
+    def add(self, datagram: bytes, addr: Any = None):
+        '''Queues `datagram` for `addr`, or for the connected peer if
+        `addr` is None.'''
+        self.queue.append((datagram, addr))
+
+    def flush(self):
+        queued = self.queue
+        self.queue = []
+        i = 0
+        while i < len(queued):
+            datagram, addr = queued[i]
+            size = len(datagram)
+            j = i + 1
+            if self.gso:
+                total = size
+                while (j < len(queued) and j - i < max_gso_segments and queued[j][1] == addr
+                       and len(queued[j][0]) <= size and total + len(queued[j][0]) <= max_gso_bytes):
+                    total += len(queued[j][0])
+                    j += 1
+                    if len(queued[j - 1][0]) < size:
+                        # Only the last segment may be shorter
+                        break
+            if j - i > 1 and self.send_segmented([d for d, _ in queued[i:j]], size, addr):
+                i = j
+                continue
+            self.send_one(datagram, addr)
+            i += 1
+
+    def send_segmented(self, datagrams: List[bytes], size: int, addr: Any) -> bool:
+        '''Sends `datagrams` with one GSO `sendmsg`. Returns False, and
+        turns GSO off, if the kernel does not support it.'''
+        ancillary = [(SOL_UDP, UDP_SEGMENT, struct.pack("=H", size))]
+        try:
+            self.syscalls += 1
+            if addr is None:
+                self.socket.sendmsg(datagrams, ancillary)
+            else:
+                self.socket.sendmsg(datagrams, ancillary, 0, addr)
+        except BlockingIOError:
+            # Socket buffer full: the datagrams are lost, like any UDP packet
+            pass
+        except OSError as e:
+            if isinstance(e, (ConnectionError, socket.timeout)):
+                raise
+            self.gso = False
+            return False
+        return True
+
+    def send_one(self, datagram: bytes, addr: Any):
+        try:
+            self.syscalls += 1
+            if addr is None:
+                self.socket.send(datagram)
+            else:
+                self.socket.sendto(datagram, addr)
+        except BlockingIOError:
+            pass
+
+
+class BatchReader:
+    '''Reads datagrams in batches.
+
+    With UDP generic receive offload (`UDP_GRO`), the kernel may merge
+    several same-sized datagrams from one sender into a single buffer;
+    `read_batch` splits them up again using the segment size it reports.
+    Without GRO it falls back to one `recvfrom` per datagram.
+
+    '''
+
+    def __init__(self, sock: socket.socket, gro: bool = True):
+        self.socket = sock
+        self.gro = False
+        self.syscalls = 0
+        if gro and hasattr(socket, "CMSG_SPACE"):
+            try:
+                sock.setsockopt(SOL_UDP, UDP_GRO, 1)
+                self.gro = True
+            except OSError:
+                pass
+        if gro:
+            # The kernel may cap this at net.core.rmem_max
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer_size)
+        self.ancillary_size = socket.CMSG_SPACE(4) if self.gro else 0
+
+    def read_batch(self, max_datagrams: int, wait: bool = False) -> List[Tuple[bytes, Any]]:
+        '''Returns up to `max_datagrams` (datagram, address) pairs that are
+        already queued. With `wait`, blocks for the first one according
+        to the socket's timeout (raising `socket.timeout` as usual).'''
+        datagrams: List[Tuple[bytes, Any]] = []
+        timeout = self.socket.gettimeout()
+        if not wait:
+            self.socket.settimeout(0.0)
+        try:
+            while len(datagrams) < max_datagrams:
+                try:
+                    self.syscalls += 1
+                    if self.gro:
+                        data, ancillary, _, addr = self.socket.recvmsg(max_read_size, self.ancillary_size)
+                    else:
+                        data, addr = self.socket.recvfrom(max_read_size)
+                        ancillary = []
+                except BlockingIOError:
+                    break
+                # Only the first read may block: MSG_DONTWAIT is not
+                # enough, Python waits for the socket timeout before it
+                self.socket.settimeout(0.0)
+                segment = self.segment_size(ancillary) or len(data)
+                if segment >= len(data):
+                    datagrams.append((data, addr))
+                else:
+                    for start in range(0, len(data), segment):
+                        datagrams.append((data[start:start + segment], addr))
+        finally:
+            self.socket.settimeout(timeout)
+        return datagrams
+
+    def segment_size(self, ancillary: List[Tuple[int, int, bytes]]) -> Optional[int]:
+        for level, kind, value in ancillary:
+            if level == SOL_UDP and kind == UDP_GRO:
+                return struct.unpack("=i", value[:4])[0]
+        return None
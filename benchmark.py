@@ -0,0 +1,310 @@
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Tuple
+
+import wire
+from transport import Receiver, Sender, format_stats, packet_size
+
+# Microbenchmarks of the per-packet code paths, without sockets:
+#
+# - "receiver": `Receiver.data_packet` over a stream of arrivals
+# - "sender": `Sender.send` and `Sender.ack_packet` in a closed loop, with
+#   a `Receiver` (not timed) producing the ACKs
+# - "segment": `Receiver.Segment.merge` on its own
+#
+# Each runs under generated workloads (see `WORKLOADS`) at each file size
+# and reports nanoseconds per packet and, in a second pass under
+# tracemalloc, the peak memory allocated by Python. Results can be saved
+# as a baseline and later runs compared against it, so that a change
+# that slows down one of these loops shows up as a failed comparison.
+
+BENCHES = ("receiver", "sender", "segment")
+
+# Payload bytes per packet, as in the binary wire format
+payload_size = wire.max_payload(wire.WIRE_BINARY, packet_size)
+# Virtual seconds that pass per ACK in the sender loop. RACK loss
+# detection needs time to move.
+ack_tick = 1e-5
+# Segment pairs per round of the merge benchmark
+merge_pairs = 100000
+
+SIZE_UNITS = {"kb": 10 ** 3, "mb": 10 ** 6, "gb": 10 ** 9, "b": 1}
+
+
+class Workload(NamedTuple):
+    '''How packets arrive, one window at a time.
+
+    `loss` is the fraction of packets dropped. Dropped packets reach the
+    receiver benchmark one window later, like a retransmission; in the
+    sender benchmark the sender has to notice and retransmit them itself.
+    `shuffle` delivers each window in random order. `interleave` delivers
+    the even packets of each window first and then the odd ones, leaving
+    window / 2 holes open at once. `all_blocks` hands the sender every
+    out-of-order range instead of at most `max_sack_blocks`, as in an ACK
+    decoded from a SACK bitmap, so SACK lists reach thousands of blocks.
+
+    '''
+    loss: float = 0.0
+    shuffle: bool = False
+    interleave: bool = False
+    window: int = 256
+    all_blocks: bool = False
+
+    def order(self, window: List[Any], rng: random.Random) -> List[Any]:
+        if self.shuffle:
+            window = window[:]
+            rng.shuffle(window)
+        elif self.interleave:
+            window = window[::2] + window[1::2]
+        return window
+
+
+WORKLOADS: Dict[str, Workload] = {
+    "inorder": Workload(),
+    "loss1": Workload(loss=0.01),
+    "loss5": Workload(loss=0.05),
+    "loss20": Workload(loss=0.20),
+    "reorder": Workload(shuffle=True),
+    "sack": Workload(interleave=True, window=4096, all_blocks=True),
+}
+
+
+def parse_size(text: str) -> int:
+    '''"10MB" -> 10000000. Plain numbers are bytes.'''
+    text = text.strip().lower()
+    for unit, factor in SIZE_UNITS.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
+
+
+def format_size(size: int) -> str:
+    for unit in ("gb", "mb", "kb"):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f"{size // SIZE_UNITS[unit]}{unit.upper()}"
+    return str(size)
+
+
+def packet_range(index: int, data_len: int) -> Tuple[int, int]:
+    start = index * payload_size
+    return start, min(start + payload_size, data_len)
+
+
+def arrivals(workload: Workload, data_len: int, rng: random.Random) -> Iterator[List[int]]:
+    '''Yields the packet indices that arrive at the receiver, one window at
+    a time. Generated lazily, so a 10 GB workload takes no more memory
+    than a small one.'''
+    packets = -(-data_len // payload_size)
+    late: List[int] = []
+    for first in range(0, packets, workload.window):
+        window = late + list(range(first, min(first + workload.window, packets)))
+        late = []
+        if workload.loss:
+            delivered = []
+            for index in window:
+                (late if rng.random() < workload.loss else delivered).append(index)
+            window = delivered
+        yield workload.order(window, rng)
+    while late:
+        # Retransmissions of the last windows, which may be lost again
+        window, late = late, []
+        delivered = []
+        for index in window:
+            (late if rng.random() < workload.loss else delivered).append(index)
+        yield workload.order(delivered, rng)
+
+
+def bench_receiver(workload: Workload, data_len: int, seed: int) -> Dict[str, float]:
+    receiver = Receiver()
+    payload = b"x" * payload_size
+    rng = random.Random(seed)
+    elapsed = 0
+    count = 0
+    for window in arrivals(workload, data_len, rng):
+        # Build the arguments before starting the clock
+        calls = []
+        for index in window:
+            seq = packet_range(index, data_len)
+            calls.append((seq, payload if seq[1] - seq[0] == payload_size else payload[:seq[1] - seq[0]]))
+        start = time.perf_counter_ns()
+        for seq, data in calls:
+            receiver.data_packet(seq, data)
+        elapsed += time.perf_counter_ns() - start
+        count += len(calls)
+    assert receiver.app_sent_index == data_len and not receiver.segments
+    return {"packets": count, "ns_per_packet": elapsed / max(count, 1)}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def bench_sender(workload: Workload, data_len: int, seed: int) -> Dict[str, float]:
+    '''Sends a window of packets, delivers what the workload lets through
+    in the order it says, ACKs each, and repeats. Packets that are all
+    lost are recovered with `Sender.timeout`, as the RTO would. Only the
+    `send` and `ack_packet` calls are timed.'''
+    clock = Clock()
+    sender = Sender(data_len, payload_size, clock=clock)
+    receiver = Receiver()
+    payload = b"x" * payload_size
+    rng = random.Random(seed)
+    send_ns = ack_ns = 0
+    sends = acks = 0
+    packet_id = 0
+    while True:
+        flight: List[Tuple[Tuple[int, int], int, float]] = []
+        done = False
+        start = time.perf_counter_ns()
+        while len(flight) < workload.window:
+            seq = sender.send(packet_id)
+            if seq is None:
+                done = True
+                break
+            if seq[0] == seq[1]:
+                break
+            flight.append((seq, packet_id, clock.now))
+            packet_id += 1
+        send_ns += time.perf_counter_ns() - start
+        sends += len(flight)
+        if done:
+            break
+        if not flight:
+            # Everything still in flight was lost
+            sender.timeout()
+            continue
+        delivered = [sent for sent in flight if not workload.loss or rng.random() >= workload.loss]
+        for seq, sent_id, sent_at in workload.order(delivered, rng):
+            sacks, _ = receiver.data_packet(seq, payload if seq[1] - seq[0] == payload_size else payload[:seq[1] - seq[0]])
+            if workload.all_blocks:
+                sacks = [(0, receiver.app_sent_index)] + receiver.sack_ranges
+            clock.now += ack_tick
+            start = time.perf_counter_ns()
+            sender.ack_packet(sacks, sent_id, sent_at)
+            ack_ns += time.perf_counter_ns() - start
+            acks += 1
+    packets = -(-data_len // payload_size)
+    return {"packets": packets, "ns_per_packet": (send_ns + ack_ns) / packets, "send_ns": send_ns / max(sends, 1),
+            "ack_ns": ack_ns / max(acks, 1), "retransmits": sender.retransmits}
+
+
+def bench_segment(workload: Workload, data_len: int, seed: int) -> Dict[str, float]:
+    '''`merge` on pairs that overlap, touch or are disjoint, in equal
+    parts. The workload and size do not apply.'''
+    rng = random.Random(seed)
+    pairs = []
+    for i in range(merge_pairs):
+        start = rng.randrange(1 << 30)
+        gap = (-payload_size // 2, 0, payload_size)[i % 3]
+        pairs.append((Receiver.Segment(start, start + payload_size),
+                      Receiver.Segment(start + payload_size + gap, start + 2 * payload_size + gap)))
+    rounds = 10
+    start = time.perf_counter_ns()
+    for _ in range(rounds):
+        for segment, other in pairs:
+            segment.merge(other)
+    elapsed = time.perf_counter_ns() - start
+    return {"packets": rounds * merge_pairs, "ns_per_packet": elapsed / (rounds * merge_pairs)}
+
+
+RUNNERS: Dict[str, Callable[[Workload, int, int], Dict[str, float]]] = {
+    "receiver": bench_receiver,
+    "sender": bench_sender,
+    "segment": bench_segment,
+}
+
+
+def peak_memory(runner: Callable[[Workload, int, int], Dict[str, float]], workload: Workload, data_len: int,
+                seed: int) -> int:
+    '''Peak bytes allocated through Python while `runner` runs. A separate
+    pass, since tracing allocations slows everything down.'''
+    tracemalloc.start()
+    try:
+        runner(workload, data_len, seed)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(bench: str, workload_name: str, data_len: int, repeats: int, memory: bool, seed: int) -> Dict[str, float]:
+    '''Best of `repeats` runs, which is the least disturbed by whatever
+    else the machine is doing.'''
+    runner = RUNNERS[bench]
+    workload = WORKLOADS[workload_name]
+    result = min((runner(workload, data_len, seed) for _ in range(max(1, repeats))),
+                 key=lambda result: result["ns_per_packet"])
+    if memory:
+        result["peak_kb"] = peak_memory(runner, workload, data_len, seed) / 1024.0
+    return result
+
+
+def result_key(bench: str, workload: str, data_len: int) -> str:
+    return f"{bench}/{workload}/{format_size(data_len)}"
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float) -> List[str]:
+    '''Prints each result against its baseline and returns the keys that
+    got slower, or use more memory, by more than `tolerance`.'''
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        line = [key]
+        regressed = False
+        for metric in ("ns_per_packet", "peak_kb"):
+            if metric in result and baseline[key].get(metric):
+                ratio = result[metric] / baseline[key][metric]
+                line.append(f"{metric}={ratio:.2f}x")
+                regressed = regressed or ratio > 1.0 + tolerance
+        if regressed:
+            regressions.append(key)
+            line.append("REGRESSION")
+        print(" ".join(line))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the Sender and Receiver per-packet paths")
+    parser.add_argument("--bench", choices=BENCHES, nargs="+", default=list(BENCHES), help="Code paths to benchmark")
+    parser.add_argument("--workload", choices=sorted(WORKLOADS), nargs="+", default=list(WORKLOADS), help="Arrival patterns")
+    parser.add_argument("--sizes", type=str, nargs="+", default=["1MB", "10MB"], help="File sizes, e.g. 1MB 100MB 10GB")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per benchmark; the fastest is reported")
+    parser.add_argument("--no_memory", action="store_true", help="Skip the peak memory pass")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated workloads")
+    parser.add_argument("--save", type=str, required=False, help="Write the results to this JSON file, to use as a baseline")
+    parser.add_argument("--baseline", type=str, required=False, help="Compare against results saved with --save. Exits with status 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Slowdown (or memory growth) over the baseline, as a fraction, that counts as a regression")
+    args = parser.parse_args()
+
+    results: Dict[str, Dict[str, float]] = {}
+    for bench in args.bench:
+        # The merge benchmark does not depend on the workload or size
+        workloads = args.workload if bench != "segment" else ["inorder"]
+        sizes = [parse_size(size) for size in args.sizes] if bench != "segment" else [0]
+        for workload in workloads:
+            for data_len in sizes:
+                key = result_key(bench, workload, data_len) if bench != "segment" else "segment/merge"
+                results[key] = run(bench, workload, data_len, args.repeats, not args.no_memory, args.seed)
+                print(key, format_stats(results[key]), flush=True)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {' '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
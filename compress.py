@@ -0,0 +1,119 @@
+import zlib
+from typing import List, Tuple, Union
+
+# Per-packet payload compression for the binary wire format.
+#
+# Every packet is compressed on its own (raw deflate), so it can be
+# decompressed without any other packet: losing one costs nothing more
+# than losing an uncompressed one. Packets are too short for deflate to
+# find much repetition within them, so both ends prime it with the same
+# preset dictionary of text the data is likely to contain. A different
+# dictionary is a different, incompatible mode, so it has its own tag in
+# the handshake (see wire.py).
+
+# Capability advertised in the handshake. Bump it whenever
+# `PRESET_DICTIONARY` or the payload layout changes.
+COMPRESS_TAG = "deflate1"
+
+# zlib compression level of data payloads
+compress_level = 3
+# Most source bytes one compressed payload may stand for. The receiver
+# refuses larger spans, which bounds what one packet can make it inflate.
+max_span = 1 << 16
+
+# Words of the generated test data (python `lorem`), capitalized at the
+# start of each sentence, followed by common English words
+_LOREM_WORDS = ("adipisci aliquam amet consectetur dolor dolore dolorem eius est etincidunt ipsum labore magnam "
+                "modi neque non numquam porro quaerat quiquia quisquam sed sit tempora ut velit voluptatem").split()
+_ENGLISH_WORDS = ("the of and to in is that for it as was with be by on not he this are or his from at which but have "
+                  "an had they you were their one all we can her has there been if more when will would who so no "
+                  "she other its may these than them time what some only into out could about first also any each "
+                  "our many then do very how new after two most such where over even now just like those well "
+                  "through made between should because being both under same before while see great").split()
+
+
+def _build_dictionary() -> bytes:
+    # zlib favours the end of the dictionary (it is closest to the data),
+    # so the most likely strings come last
+    parts = [" ".join(_ENGLISH_WORDS), " ".join(word.capitalize() for word in _ENGLISH_WORDS), ". \n\n"]
+    for word in _LOREM_WORDS:
+        parts.append(f"{word.capitalize()} {word} {word}. ")
+    parts.append(" ".join(_LOREM_WORDS) + ".\n\n")
+    return "".join(parts).encode()
+
+
+PRESET_DICTIONARY = _build_dictionary()
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+def compress(data: Buffer, level: int = compress_level) -> bytes:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=PRESET_DICTIONARY)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(payload: Buffer, length: int) -> bytes:
+    '''Inflates a payload that must stand for exactly `length` bytes.
+    Raises ValueError if it does not, or is not valid deflate data.'''
+    if length > max_span:
+        raise ValueError(f"Compressed span of {length} bytes is too large")
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=PRESET_DICTIONARY)
+    try:
+        data = decompressor.decompress(payload, length + 1)
+    except zlib.error as e:
+        raise ValueError(f"Bad compressed payload: {e}")
+    if len(data) != length or not decompressor.eof:
+        raise ValueError("Compressed payload does not match sequence range")
+    return data
+
+
+class PayloadPacker:
+    '''Fills payloads of at most `budget` bytes with as many whole packets
+    of source data as still fit once compressed.
+
+    The sender offers a run of contiguous packets (`pack`); the packer
+    compresses the first few of them as one payload. It starts from the
+    number of packets that fit last time and tries one more, then backs
+    off one packet at a time while the result is too large, so a run of
+    similar data costs about two compressions per payload. Data that
+    does not compress is sent raw, one packet per payload.
+
+    '''
+
+    def __init__(self, budget: int, level: int = compress_level):
+        self.budget = budget
+        self.level = level
+        self.packets = 1
+        # Totals, for the compression ratio
+        self.source_bytes = 0
+        self.wire_bytes = 0
+
+    def pack(self, data: Buffer, ends: List[int]) -> Tuple[int, bytes, bool]:
+        '''`data` holds the source bytes of a run of packets, which end at
+        the offsets `ends` (ascending, the first packet alone ending at
+        `ends[0]`). Returns how many bytes of `data` the payload covers
+        (one of `ends`), the payload, and whether it is compressed.'''
+        count = min(self.packets, len(ends))
+        payload = compress(data[:ends[count - 1]], self.level)
+        if len(payload) <= self.budget and count < len(ends):
+            bigger = compress(data[:ends[count]], self.level)
+            if len(bigger) <= self.budget:
+                count += 1
+                payload = bigger
+        while len(payload) > self.budget and count > 1:
+            count -= 1
+            payload = compress(data[:ends[count - 1]], self.level)
+        self.packets = count
+        if count == 1 and len(payload) >= ends[0]:
+            # Incompressible: raw is no larger and costs the receiver nothing
+            payload = bytes(data[:ends[0]])
+            self.source_bytes += ends[0]
+            self.wire_bytes += ends[0]
+            return ends[0], payload, False
+        self.source_bytes += ends[count - 1]
+        self.wire_bytes += len(payload)
+        return ends[count - 1], payload, True
+
+    def ratio(self) -> float:
+        '''Source bytes per payload byte sent so far.'''
+        return self.source_bytes / self.wire_bytes if self.wire_bytes else 1.0
@@ -0,0 +1,384 @@
+import math
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+# Names accepted by `--cc`
+CC_AIMD = "aimd"
+CC_FIXED = "fixed"
+CC_VEGAS = "vegas"
+CC_CUBIC = "cubic"
+CC_BBR = "bbr"
+
+# Initial slow start threshold, in bytes (64KB)
+initial_ssthresh = 64 * 1024
+
+
+class CongestionControl:
+    '''Decides how many bytes the sender may have in flight.
+
+    The `Sender` reports events through the callbacks below and reads
+    `cwnd` (in bytes) back. Times are in seconds, as returned by
+    `time.time()`, and sizes are in bytes. `mss` is the size of a full
+    packet on the wire, which is also the unit windows grow by.
+
+    '''
+
+    def __init__(self, mss: int):
+        self.mss = mss
+        self.cwnd: float = mss
+        self.ssthresh: float = initial_ssthresh
+
+    def on_ack(self, acked: int, now: float):
+        '''`acked` new bytes were acknowledged.'''
+
+    def on_loss(self, lost: int, now: float):
+        '''`lost` bytes were detected as lost without a timeout (e.g. by
+        duplicate ACKs). Called once per loss episode.'''
+
+    def on_timeout(self, now: float):
+        '''The retransmission timer fired.'''
+
+    def rtt_sample(self, rtt: float, now: float):
+        '''A new round-trip time measurement.'''
+
+    def in_slow_start(self) -> bool:
+        return self.cwnd < self.ssthresh
+
+    def pacing_rate(self, srtt: Optional[float]) -> Optional[float]:
+        '''The rate, in bytes per second, to pace packets at when pacing is
+        on: the window spread over one smoothed RTT. Like Linux, we add
+        headroom (2x in slow start, 1.2x after) so that pacing does not
+        keep the window from growing. None until we have an RTT sample.
+        '''
+        if srtt is None:
+            return None
+        gain = 2.0 if self.in_slow_start() else 1.2
+        return gain * self.cwnd / max(srtt, 1e-6)
+
+
+class Aimd(CongestionControl):
+    '''Slow start, then additive increase of one MSS per RTT. Timeouts
+    halve the window.'''
+
+    def on_ack(self, acked: int, now: float):
+        if self.cwnd < self.ssthresh:
+            # Slow start: increase by approximately one MSS per ACKed packet
+            self.cwnd += acked
+        else:
+            # Using the formula: add (ack_bytes * MSS) / cwnd_bytes
+            # Yields ~1*MSS increase per RTT
+            self.cwnd += acked * self.mss / max(1.0, self.cwnd)
+
+    def on_loss(self, lost: int, now: float):
+        # Fast recovery: halve the window but skip slow start
+        self.ssthresh = max(self.cwnd / 2.0, 2.0 * self.mss)
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self, now: float):
+        self.cwnd = max(self.cwnd / 2.0, self.mss)
+        self.ssthresh = max(self.cwnd, self.mss)
+
+
+class FixedWindow(CongestionControl):
+    '''A constant window of `packets` packets, whatever happens. Used to
+    measure goodput as a function of the window (see goodput_sender.py).'''
+
+    def __init__(self, mss: int, packets: int = 200):
+        super().__init__(mss)
+        self.cwnd = packets * mss
+        self.ssthresh = self.cwnd
+
+    def pacing_rate(self, srtt: Optional[float]) -> Optional[float]:
+        if srtt is None:
+            return None
+        return self.cwnd / max(srtt, 1e-6)
+
+
+class Vegas(Aimd):
+    '''TCP Vegas: delay-based congestion avoidance.
+
+    Once per RTT, the packets we keep queued at the bottleneck are
+    estimated as `cwnd * (1 - base_rtt / rtt) / mss`, where `base_rtt` is
+    the smallest RTT seen and `rtt` the smallest one of the last round.
+    The window grows by one packet while fewer than `alpha` are queued and
+    shrinks by one when more than `beta` are. Slow start ends as soon as
+    more than `gamma` packets queue up. Losses are handled like AIMD.
+
+    '''
+
+    alpha = 2
+    beta = 4
+    gamma = 1
+
+    def __init__(self, mss: int):
+        super().__init__(mss)
+        self.base_rtt = math.inf
+        self.round_rtt = math.inf
+        self.round_end: Optional[float] = None
+
+    def rtt_sample(self, rtt: float, now: float):
+        self.base_rtt = min(self.base_rtt, rtt)
+        self.round_rtt = min(self.round_rtt, rtt)
+
+    def on_ack(self, acked: int, now: float):
+        if self.round_end is None or self.round_rtt == math.inf:
+            super().on_ack(acked, now)
+            if self.round_rtt != math.inf:
+                self.round_end = now + self.round_rtt
+            return
+        if now < self.round_end:
+            if self.cwnd < self.ssthresh:
+                self.cwnd += acked
+            return
+
+        queued = self.cwnd * (1.0 - self.base_rtt / self.round_rtt) / self.mss
+        if self.cwnd < self.ssthresh:
+            if queued > self.gamma:
+                self.ssthresh = self.cwnd
+            else:
+                self.cwnd += acked
+        elif queued < self.alpha:
+            self.cwnd += self.mss
+        elif queued > self.beta:
+            self.cwnd = max(self.cwnd - self.mss, 2.0 * self.mss)
+        self.round_end = now + self.round_rtt
+        self.round_rtt = math.inf
+
+
+class Cubic(CongestionControl):
+    '''CUBIC (RFC 8312).
+
+    After a loss the window follows `C * (t - K)^3 + W_max` (in packets),
+    where `t` is the time since the loss and `W_max` the window at the
+    loss: it climbs back quickly, plateaus near `W_max`, then probes
+    beyond it. It never grows slower than the AIMD window an equivalent
+    Reno flow would have (the "TCP-friendly" region).
+
+    '''
+
+    c = 0.4
+    beta = 0.7
+
+    def __init__(self, mss: int):
+        super().__init__(mss)
+        self.w_max = 0.0
+        self.k = 0.0
+        self.epoch_start: Optional[float] = None
+        self.w_est = 0.0
+        self.min_rtt: Optional[float] = None
+
+    def rtt_sample(self, rtt: float, now: float):
+        if self.min_rtt is None or rtt < self.min_rtt:
+            self.min_rtt = rtt
+
+    def on_ack(self, acked: int, now: float):
+        if self.cwnd < self.ssthresh:
+            self.cwnd += acked
+            return
+        cwnd = self.cwnd / self.mss
+        if self.epoch_start is None:
+            self.epoch_start = now
+            if self.w_max <= cwnd:
+                self.k = 0.0
+                self.w_max = cwnd
+            else:
+                self.k = ((self.w_max - cwnd) / self.c) ** (1.0 / 3.0)
+            self.w_est = cwnd
+        # Aim for where the curve will be one RTT from now
+        t = now - self.epoch_start + (self.min_rtt or 0.0)
+        target = self.c * (t - self.k) ** 3 + self.w_max
+        self.w_est += 3.0 * (1.0 - self.beta) / (1.0 + self.beta) * (acked / self.mss) / cwnd
+        target = max(target, self.w_est)
+        if target > cwnd:
+            self.cwnd += self.mss * (target - cwnd) / cwnd * (acked / self.mss)
+        else:
+            # Grow very slowly while at the plateau
+            self.cwnd += self.mss * 0.01 * (acked / self.mss) / cwnd
+
+    def _reduce(self):
+        cwnd = self.cwnd / self.mss
+        # Fast convergence: give up bandwidth to newer flows if we were
+        # reduced before reaching the last `w_max`
+        if cwnd < self.w_max:
+            self.w_max = cwnd * (1.0 + self.beta) / 2.0
+        else:
+            self.w_max = cwnd
+        self.epoch_start = None
+        self.ssthresh = max(self.cwnd * self.beta, 2.0 * self.mss)
+
+    def on_loss(self, lost: int, now: float):
+        self._reduce()
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self, now: float):
+        self._reduce()
+        self.cwnd = self.mss
+
+
+class Bbr(CongestionControl):
+    '''A BBR-like model-based controller.
+
+    Instead of reacting to loss, it estimates the bottleneck bandwidth
+    (the largest delivery rate seen over the last `bw_window_rounds`
+    RTTs) and the propagation delay (the smallest RTT of the last
+    `min_rtt_window` seconds). Packets are paced at a gain times the
+    bandwidth, and the window is `cwnd_gain` times their product (the
+    BDP). The gain goes through BBR's phases: STARTUP doubles the rate
+    each round until the bandwidth stops growing, DRAIN empties the
+    queue this built, PROBE_BW cycles around 1 to probe for more
+    bandwidth, and PROBE_RTT shrinks the window now and then so the
+    minimum RTT can be measured again.
+
+    The delivery rate is sampled as the bytes ACKed over the last
+    minimum RTT, rather than per packet as in Linux.
+
+    '''
+
+    STARTUP = "startup"
+    DRAIN = "drain"
+    PROBE_BW = "probe_bw"
+    PROBE_RTT = "probe_rtt"
+
+    high_gain = 2.0 / math.log(2.0)
+    cwnd_gain = 2.0
+    probe_bw_gains = (1.25, 0.75, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0)
+    bw_window_rounds = 10
+    min_rtt_window = 10.0
+    probe_rtt_duration = 0.2
+    min_cwnd_packets = 4
+
+    def __init__(self, mss: int):
+        super().__init__(mss)
+        self.ssthresh = math.inf
+        self.state = self.STARTUP
+        self.pacing_gain = self.high_gain
+        self.min_rtt: Optional[float] = None
+        self.min_rtt_stamp = 0.0
+        self.delivered = 0
+        # (time, delivered) after each ACK within the last `min_rtt`
+        self.history: Deque[Tuple[float, int]] = deque()
+        # (round, rate) candidates for the windowed maximum
+        self.bw_samples: Deque[Tuple[int, float]] = deque()
+        self.round = 0
+        self.round_end: Optional[float] = None
+        self.full_bw = 0.0
+        self.full_bw_rounds = 0
+        self.cycle_index = 0
+        self.probe_rtt_end = 0.0
+        self.prior_cwnd = self.cwnd
+
+    @property
+    def btl_bw(self) -> float:
+        return self.bw_samples[0][1] if self.bw_samples else 0.0
+
+    def bdp(self) -> float:
+        if self.min_rtt is None:
+            return 0.0
+        return self.btl_bw * self.min_rtt
+
+    def in_slow_start(self) -> bool:
+        return self.state == self.STARTUP
+
+    def rtt_sample(self, rtt: float, now: float):
+        if self.min_rtt is None or rtt <= self.min_rtt or now - self.min_rtt_stamp > self.min_rtt_window:
+            if self.min_rtt is not None and now - self.min_rtt_stamp > self.min_rtt_window \
+                    and self.state != self.PROBE_RTT:
+                # The estimate is stale: drain the queue to measure it again
+                self.state = self.PROBE_RTT
+                self.pacing_gain = 1.0
+                self.prior_cwnd = self.cwnd
+                self.probe_rtt_end = now + max(self.probe_rtt_duration, rtt)
+            self.min_rtt = rtt
+            self.min_rtt_stamp = now
+
+    def on_ack(self, acked: int, now: float):
+        self.delivered += acked
+        self.history.append((now, self.delivered))
+        if self.min_rtt is None:
+            # No model yet: grow like slow start
+            self.cwnd += acked
+            return
+        while len(self.history) > 2 and now - self.history[1][0] >= self.min_rtt:
+            self.history.popleft()
+        start_time, start_delivered = self.history[0]
+        if now > start_time:
+            self._update_bw((self.delivered - start_delivered) / (now - start_time))
+
+        new_round = self.round_end is None or now >= self.round_end
+        if new_round:
+            self.round += 1
+            self.round_end = now + self.min_rtt
+            self._advance_state(now)
+
+        target = self.cwnd_gain * self.bdp()
+        if self.state == self.PROBE_RTT:
+            self.cwnd = self.min_cwnd_packets * self.mss
+        elif self.state == self.STARTUP:
+            target = max(self.high_gain * self.bdp(), target)
+            self.cwnd = max(self.cwnd, min(self.cwnd + acked, target))
+        else:
+            self.cwnd = min(self.cwnd + acked, target)
+        self.cwnd = max(self.cwnd, self.min_cwnd_packets * self.mss)
+
+    def _update_bw(self, rate: float):
+        while self.bw_samples and self.bw_samples[-1][1] <= rate:
+            self.bw_samples.pop()
+        self.bw_samples.append((self.round, rate))
+        while self.bw_samples[0][0] <= self.round - self.bw_window_rounds:
+            self.bw_samples.popleft()
+
+    def _advance_state(self, now: float):
+        if self.state == self.STARTUP:
+            # The pipe is full once the bandwidth grew less than 25% in
+            # three rounds
+            if self.btl_bw >= 1.25 * self.full_bw:
+                self.full_bw = self.btl_bw
+                self.full_bw_rounds = 0
+            else:
+                self.full_bw_rounds += 1
+                if self.full_bw_rounds >= 3:
+                    self.state = self.DRAIN
+                    self.pacing_gain = 1.0 / self.high_gain
+        elif self.state == self.DRAIN:
+            # Lasts one round, which drains what the high gain queued
+            self._enter_probe_bw()
+        elif self.state == self.PROBE_BW:
+            self.cycle_index = (self.cycle_index + 1) % len(self.probe_bw_gains)
+            self.pacing_gain = self.probe_bw_gains[self.cycle_index]
+        elif self.state == self.PROBE_RTT and now >= self.probe_rtt_end:
+            self.cwnd = max(self.cwnd, self.prior_cwnd)
+            self.min_rtt_stamp = now
+            self._enter_probe_bw()
+
+    def _enter_probe_bw(self):
+        self.state = self.PROBE_BW
+        self.cycle_index = 0
+        self.pacing_gain = self.probe_bw_gains[0]
+
+    def on_timeout(self, now: float):
+        # Keep the model, but restart from a small window
+        self.prior_cwnd = max(self.prior_cwnd, self.cwnd)
+        self.cwnd = self.min_cwnd_packets * self.mss
+
+    def pacing_rate(self, srtt: Optional[float]) -> Optional[float]:
+        if self.btl_bw == 0.0:
+            # No bandwidth sample yet: pace the window like the others do
+            return super().pacing_rate(srtt)
+        return self.pacing_gain * self.btl_bw
+
+
+CONTROLLERS: Dict[str, type] = {
+    CC_AIMD: Aimd,
+    CC_FIXED: FixedWindow,
+    CC_VEGAS: Vegas,
+    CC_CUBIC: Cubic,
+    CC_BBR: Bbr,
+}
+
+
+def make_controller(name: str, mss: int, fixed_cwnd_pkts: Optional[int] = None) -> CongestionControl:
+    '''Creates the controller called `name` (one of `CONTROLLERS`).
+    `fixed_cwnd_pkts` is the window of the fixed-window controller.'''
+    if name == CC_FIXED and fixed_cwnd_pkts is not None:
+        return FixedWindow(mss, fixed_cwnd_pkts)
+    return CONTROLLERS[name](mss)
@@ -0,0 +1,326 @@
+import argparse
+import bisect
+import heapq
+import random
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import wire
+from compress import PayloadPacker
+from congestion import CONTROLLERS, CC_AIMD, CC_FIXED, make_controller
+from fec import FecEncoder, Parity
+from telemetry import SENDER_FIELDS, Telemetry
+from transport import Receiver, Sender, fill_packet, format_stats, max_sack_blocks, packet_size
+
+# Discrete-event emulation of the Mahimahi setup in the README
+# (mm-delay + mm-link with a droptail uplink queue), driving `Sender` and
+# `Receiver` directly instead of through sockets. Time is virtual: it
+# jumps from one event to the next, so a transfer that takes a minute on
+# the emulated link runs in a fraction of that, and with a fixed `seed`
+# every run gives exactly the same result.
+
+# Bytes one delivery opportunity of a Mahimahi trace can carry
+# (mahimahi's PACKET_SIZE: an MTU plus a 4 byte tunnel header)
+opportunity_bytes = 1504
+# IP and UDP headers, which Mahimahi counts but the sockets API hides
+ip_udp_overhead = 28
+# Emulations stop after this many virtual seconds even if unfinished
+max_duration = 600.0
+
+
+class Trace:
+    '''A Mahimahi packet delivery trace: one line per delivery opportunity,
+    each the time in milliseconds at which `opportunity_bytes` may leave
+    the link. The trace repeats with a period of its last timestamp, so
+    a file with the single line "1" is a 12 Mbit/s link.'''
+
+    def __init__(self, timestamps: List[int]):
+        if not timestamps or timestamps[-1] <= 0:
+            raise ValueError("A trace needs at least one positive timestamp")
+        self.timestamps = sorted(timestamps)
+        self.period = self.timestamps[-1]
+
+    @classmethod
+    def load(cls, path: str) -> "Trace":
+        with open(path) as f:
+            return cls([int(line) for line in f if line.strip()])
+
+    def next_opportunity(self, now: float) -> float:
+        '''Time, in seconds, of the first delivery opportunity after `now`.'''
+        # Rounded so that float error cannot land us just before `now`
+        ms = round(now * 1000.0, 6)
+        cycle, offset = divmod(ms, self.period)
+        i = bisect.bisect_right(self.timestamps, offset)
+        if i == len(self.timestamps):
+            cycle += 1
+            i = 0
+        return (cycle * self.period + self.timestamps[i]) / 1000.0
+
+
+class EventLoop:
+    '''Runs callbacks in virtual time order.'''
+
+    def __init__(self):
+        self.now = 0.0
+        self.events: List[Tuple[float, int, Callable[..., None], Tuple[Any, ...]]] = []
+        self.counter = 0
+
+    def at(self, when: float, callback: Callable[..., None], *args: Any):
+        # The counter keeps events at the same time in scheduling order
+        self.counter += 1
+        heapq.heappush(self.events, (when, self.counter, callback, args))
+
+    def run(self, until: float):
+        while self.events and self.events[0][0] <= until:
+            self.now, _, callback, args = heapq.heappop(self.events)
+            callback(*args)
+
+
+class Link:
+    '''One direction of an emulated path: random loss, then a droptail
+    queue drained by a trace (mm-link), then a fixed delay (mm-delay).
+
+    As in Mahimahi, each delivery opportunity carries `opportunity_bytes`,
+    and a packet larger than what is left of one finishes in the next.
+
+    '''
+
+    def __init__(self, loop: EventLoop, trace: Trace, delay: float, queue_bytes: Optional[int], loss: float,
+                 rng: random.Random, deliver: Callable[[bytes], None]):
+        self.loop = loop
+        self.trace = trace
+        self.delay = delay
+        self.queue_bytes = queue_bytes
+        self.loss = loss
+        self.rng = rng
+        self.deliver = deliver
+        self.queue: List[bytes] = []
+        self.head = 0
+        self.queued = 0
+        # Bytes of the packet at the head of the queue still to transmit
+        self.head_left = 0
+        self.scheduled = False
+        self.drops = 0
+
+    def send(self, packet: bytes):
+        size = len(packet) + ip_udp_overhead
+        if self.loss and self.rng.random() < self.loss:
+            self.drops += 1
+            return
+        if self.queue_bytes is not None and self.queued + size > self.queue_bytes:
+            self.drops += 1
+            return
+        if self.head == len(self.queue):
+            self.head_left = size
+        self.queue.append(packet)
+        self.queued += size
+        if not self.scheduled:
+            self.scheduled = True
+            self.loop.at(self.trace.next_opportunity(self.loop.now), self.opportunity)
+
+    def opportunity(self):
+        budget = opportunity_bytes
+        while budget > 0 and self.head < len(self.queue):
+            sent = min(budget, self.head_left)
+            budget -= sent
+            self.head_left -= sent
+            if self.head_left == 0:
+                packet = self.queue[self.head]
+                self.head += 1
+                self.queued -= len(packet) + ip_udp_overhead
+                self.loop.at(self.loop.now + self.delay, self.deliver, packet)
+                if self.head < len(self.queue):
+                    self.head_left = len(self.queue[self.head]) + ip_udp_overhead
+        if self.head > 1024 and self.head * 2 > len(self.queue):
+            # Drop delivered packets from the front now and then
+            del self.queue[:self.head]
+            self.head = 0
+        if self.head < len(self.queue):
+            self.loop.at(self.trace.next_opportunity(self.loop.now), self.opportunity)
+        else:
+            self.scheduled = False
+
+
+class Emulation:
+    '''One transfer of `data_len` bytes from a `Sender` to a `Receiver`
+    over an emulated path.
+
+    The sender side follows the loop of `transport.start_sender`: fill
+    the window, then wait for ACKs, with a retransmission timeout of
+    `Sender.get_rto()` since the last ACK. Pacing is not emulated. ACKs
+    cross their own link, with `ack_trace` (the data trace if not given)
+    and an unlimited queue, like `--downlink-queue=infinite`. The
+    sender's events go to `telemetry` if given, in virtual time.
+
+    The bytes sent are `data` if given (its length must be `data_len`)
+    and filler otherwise. With `compress` and the binary format, payloads
+    are compressed as by `transport.start_sender`, and with `fec` parity
+    packets follow each group of data packets, as with `--fec`.
+
+    '''
+
+    def __init__(self, data_len: int, trace: Trace, delay: float = 0.010, queue_bytes: Optional[int] = 30000,
+                 loss: float = 0.0, cc: str = CC_AIMD, fixed_cwnd: int = 200, recv_window: int = 15000000,
+                 wire_format: str = wire.WIRE_BINARY, ack_trace: Optional[Trace] = None, seed: int = 0,
+                 telemetry: Optional[Telemetry] = None, data: Optional[bytes] = None, compress: bool = False,
+                 fec: bool = False):
+        self.loop = EventLoop()
+        rng = random.Random(seed)
+        self.uplink = Link(self.loop, trace, delay, queue_bytes, loss, rng, self.receive_data)
+        self.downlink = Link(self.loop, ack_trace or trace, delay, None, loss, rng, self.receive_ack)
+        self.wire_format = wire_format
+        self.data_len = data_len
+        # Printable bytes, which JSON does not need to escape
+        self.payload = b"x" * wire.max_payload(wire_format, packet_size, text=data is None or wire.is_text(data))
+        compress = compress and wire_format == wire.WIRE_BINARY
+        if data is None and compress:
+            data = b"x" * data_len
+        self.data = data
+        self.packer = PayloadPacker(len(self.payload)) if compress else None
+        self.encoder = FecEncoder() if fec and wire_format == wire.WIRE_BINARY else None
+        self.sender = Sender(data_len, len(self.payload), make_controller(cc, packet_size, fixed_cwnd),
+                             clock=lambda: self.loop.now, telemetry=telemetry)
+        # The receiver buffers, and so advertises, `recv_window` bytes
+        self.receiver = Receiver(max_sack_blocks, window=recv_window)
+        self.recv_window = recv_window
+        self.inflight = 0
+        self.packet_id = 0
+        self.timeouts = 0
+        # Bumped whenever the retransmission timer is re-armed, so that
+        # stale timer events can be told apart
+        self.timer = 0
+        self.finished: Optional[float] = None
+
+    def run(self) -> Dict[str, float]:
+        self.loop.at(0.0, self.send_window)
+        self.loop.run(max_duration)
+        duration = self.finished if self.finished is not None else self.loop.now
+        stats: Dict[str, float] = {
+            "bytes": self.data_len,
+            "finished": int(self.finished is not None),
+            "duration": duration,
+            "goodput": self.data_len / duration if self.finished and duration > 0 else 0.0,
+            "packets": self.packet_id,
+            "timeouts": self.timeouts,
+            "drops": self.uplink.drops,
+        }
+        stats.update(self.sender.stats())
+        if self.packer is not None:
+            stats["compression"] = self.packer.ratio()
+        if self.encoder is not None:
+            stats["parity"] = self.encoder.parity_packets
+            stats["fec_recovered"] = self.receiver.fec.recovered if self.receiver.fec is not None else 0
+        return stats
+
+    def send_window(self):
+        if self.finished is not None:
+            return
+        while self.inflight + packet_size <= self.window():
+            seq = self.sender.send(self.packet_id)
+            if seq is None:
+                self.finished = self.loop.now
+                self.loop.events.clear()
+                return
+            if seq[0] == seq[1]:
+                self.send_parity(self.encoder.flush() if self.encoder is not None else None)
+                break
+            compressed = False
+            if self.packer is not None:
+                room = self.window() - self.inflight - (seq[1] - seq[0])
+                seq, payload, compressed = fill_packet(self.sender, self.data, seq, self.packet_id, room, self.packer)
+            elif self.data is not None:
+                payload = self.data[seq[0]:seq[1]]
+            else:
+                payload = self.payload[:seq[1] - seq[0]]
+            self.uplink.send(wire.encode_data(self.wire_format, seq, self.packet_id, payload, self.loop.now,
+                                              compressed=compressed, fec=self.encoder is not None))
+            self.inflight += seq[1] - seq[0]
+            self.packet_id += 1
+            if self.encoder is not None:
+                self.send_parity(self.encoder.add(seq[0], payload))
+                self.sender.fec_slack = self.encoder.group_size()
+        self.arm_timer()
+
+    def window(self) -> int:
+        # As in `transport.start_sender`: `recv_window` only until the
+        # receiver's window is known
+        cwnd = self.sender.get_cwnd()
+        return cwnd if self.sender.window_end is not None else min(self.recv_window, cwnd)
+
+    def send_parity(self, parity: Optional[Parity]):
+        if parity is not None:
+            self.uplink.send(wire.encode_parity(self.packet_id, *parity, self.loop.now))
+            self.packet_id += 1
+
+    def arm_timer(self):
+        self.timer += 1
+        self.loop.at(self.loop.now + self.sender.get_rto(), self.timeout, self.timer)
+
+    def timeout(self, timer: int):
+        if timer != self.timer or self.finished is not None:
+            return
+        self.timeouts += 1
+        self.inflight = 0
+        self.sender.timeout()
+        self.send_window()
+
+    def receive_data(self, packet: bytes):
+        received = wire.decode(packet)
+        if received["type"] == "parity":
+            sacks, _ = self.receiver.parity_packet(received["id"], received["count"], received["start_len"],
+                                                   received["payload"])
+        else:
+            sacks, _ = self.receiver.data_packet(received["seq"], received["payload"],
+                                                 received["id"] if received.get("fec") else None)
+        self.downlink.send(wire.encode_ack(received["wire"], sacks, received["id"], echo=received.get("ts"),
+                                           window=self.receiver.window))
+
+    def receive_ack(self, packet: bytes):
+        received = wire.decode(packet)
+        if self.encoder is not None:
+            self.encoder.acked(received["id"])
+        released = self.sender.ack_packet(received["sacks"], received["id"], received.get("echo"), received.get("window"))
+        self.inflight = max(0, self.inflight - released)
+        self.send_window()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulate a transfer over a Mahimahi-style link")
+    parser.add_argument("--trace", type=str, default="12mbps", help="Mahimahi trace file of the data (uplink) direction")
+    parser.add_argument("--ack_trace", type=str, required=False, help="Mahimahi trace file of the ACK direction. Defaults to --trace")
+    parser.add_argument("--delay", type=float, default=10.0, help="One-way delay in milliseconds, like mm-delay")
+    parser.add_argument("--queue_bytes", type=int, default=30000, help="Droptail queue limit of the data direction in bytes. 0 for an unlimited queue")
+    parser.add_argument("--loss", type=float, default=0.0, help="Fraction of packets (0-1) dropped at random in each direction")
+    parser.add_argument("--size", type=int, default=1000000, help="Number of bytes to transfer")
+    parser.add_argument("--recv_window", type=int, default=15000000, help="Receive window in bytes: the receiver's buffer, which it advertises")
+    parser.add_argument("--cc", choices=sorted(CONTROLLERS), default=CC_AIMD, help="The congestion control algorithm")
+    parser.add_argument("--fixed_cwnd", type=int, nargs="+", default=[200], help="With --cc fixed, the congestion window in packets. Several values run one emulation each")
+    parser.add_argument("--wire", choices=wire.WIRE_FORMATS, default=wire.WIRE_BINARY, help="The packet format, which sets the payload per packet")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random losses")
+    parser.add_argument("--sendfile", type=str, required=False, help="File whose contents to send. Overrides --size; filler bytes are sent otherwise")
+    parser.add_argument("--compress", action="store_true", help="With --wire binary, compress payloads and pack several packets into each")
+    parser.add_argument("--fec", action="store_true", help="With --wire binary, send XOR parity after each group of packets")
+    parser.add_argument("--telemetry", type=str, required=False, help="File to write the sender's telemetry to (JSON lines if it ends in .jsonl, binary otherwise). With several windows, the last run's")
+    args = parser.parse_args()
+
+    trace = Trace.load(args.trace)
+    ack_trace = Trace.load(args.ack_trace) if args.ack_trace else None
+    data = None
+    if args.sendfile:
+        with open(args.sendfile, "rb") as f:
+            data = f.read()
+        args.size = len(data)
+    windows = args.fixed_cwnd if args.cc == CC_FIXED else [args.fixed_cwnd[0]]
+    for fixed_cwnd in windows:
+        recorder = Telemetry(SENDER_FIELDS) if args.telemetry else None
+        emulation = Emulation(args.size, trace, args.delay / 1000.0, args.queue_bytes or None, args.loss, args.cc,
+                              fixed_cwnd, args.recv_window, args.wire, ack_trace, args.seed, recorder, data, args.compress,
+                              args.fec)
+        stats = emulation.run()
+        if recorder is not None:
+            recorder.dump(args.telemetry)
+        if args.cc == CC_FIXED:
+            stats = {"cwnd": fixed_cwnd, **stats}
+        print(format_stats(stats))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+from typing import Dict, List, Optional, Tuple, Union
+
+# Forward error correction with XOR parity.
+#
+# The sender XORs the payloads of a group of consecutive data packets
+# (zero-padded to the longest) into one parity packet, sent right after
+# the group. Packet ids count parity packets too, so a parity packet with
+# id `p` covering `count` packets protects exactly the ids
+# [p - count, p), and needs no list of its members. It also carries the
+# XOR of the members' start offsets and of their lengths, so the one
+# member that goes missing can be rebuilt, sequence range included, from
+# the parity and the others. Both XORs share one 64-bit field: lengths
+# take its top 16 bits (`len << 48`) and offsets the rest. Losing two
+# packets of a group still needs a retransmission.
+#
+# Groups are sized from the loss rate the sender observes (see
+# `FecEncoder.group_size`): small groups, and so more parity, when more
+# is lost.
+
+FEC_TAG = "xor1"
+
+# Bounds of the number of data packets per parity packet
+min_group = 4
+max_group = 32
+# Expected losses per group we size groups for. A group recovers from
+# one loss, so this keeps most groups within what parity can repair.
+target_group_loss = 0.5
+# Packets per loss-rate sample, and the weight of a new sample
+loss_block = 64
+loss_gain = 0.25
+# Data packets the receiver keeps for recovery, per connection
+history_size = 1024
+# Parity packets waiting for more members to arrive, per connection
+max_pending = 64
+
+Buffer = Union[bytes, bytearray, memoryview]
+# (number of members, XOR of their starts and lengths, XOR of their
+# payloads)
+Parity = Tuple[int, int, bytes]
+
+
+def _xor_into(acc: int, payload: Buffer) -> int:
+    # Little endian, so shorter payloads are implicitly zero-padded at
+    # their end
+    return acc ^ int.from_bytes(payload, "little")
+
+
+class FecEncoder:
+    '''Sender side: builds parity packets and picks the group size.
+
+    `add` is called with every data packet as it is sent (including
+    retransmissions, and packets the sender's `--simloss` then drops) and
+    returns the parity to send once the group is full. `flush` closes a
+    partial group, for the last packets before the sender waits. `acked`
+    is called with the id of every ACK, parity ACKs included, to track
+    the loss rate.
+
+    '''
+
+    def __init__(self):
+        self.loss = 0.0
+        self.reset()
+        # ACKed ids per block of `loss_block` ids
+        self.acked_blocks: Dict[int, int] = {}
+        # Blocks below this one have been sampled
+        self.sampled_block = 0
+        self.parity_packets = 0
+
+    def reset(self):
+        self.count = 0
+        self.xor = 0
+        self.xor_start = 0
+        self.xor_len = 0
+        self.max_len = 0
+
+    def group_size(self) -> int:
+        if self.loss <= 0.0:
+            return max_group
+        return max(min_group, min(max_group, int(target_group_loss / self.loss)))
+
+    def add(self, start: int, payload: Buffer) -> Optional[Parity]:
+        self.count += 1
+        self.xor = _xor_into(self.xor, payload)
+        self.xor_start ^= start
+        self.xor_len ^= len(payload)
+        self.max_len = max(self.max_len, len(payload))
+        if self.count >= self.group_size():
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[Parity]:
+        '''The parity of the packets added since the last one, or None if
+        there are fewer than two (parity of one packet is a copy).'''
+        if self.count < 2:
+            return None
+        parity = (self.count, self.xor_start ^ (self.xor_len << 48),
+                  self.xor.to_bytes(self.max_len, "little"))
+        self.reset()
+        self.parity_packets += 1
+        return parity
+
+    def acked(self, packet_id: int):
+        '''Counts an ACK. Once ACKs two blocks past a block of ids arrive,
+        the share of that block never ACKed is taken as a loss sample.
+        ACKs for blocks already sampled are ignored.'''
+        if packet_id < 0:
+            return
+        block = packet_id // loss_block
+        if block < self.sampled_block:
+            # A late ACK: counting it would start the block over
+            return
+        self.acked_blocks[block] = self.acked_blocks.get(block, 0) + 1
+        done = [b for b in self.acked_blocks if b <= block - 2]
+        for b in done:
+            sample = max(0.0, 1.0 - self.acked_blocks.pop(b) / loss_block)
+            self.loss += loss_gain * (sample - self.loss)
+            self.sampled_block = max(self.sampled_block, b + 1)
+
+
+class FecDecoder:
+    '''Receiver side: remembers recent data packets by id and rebuilds the
+    one missing member of a parity group.
+
+    A parity packet that arrives while more than one member is missing
+    waits (up to `max_pending` of them) in case the others turn up.
+
+    '''
+
+    def __init__(self):
+        # packet id -> (start, payload)
+        self.history: Dict[int, Tuple[int, Buffer]] = {}
+        # parity id -> (count, start/length XOR, payload)
+        self.pending: Dict[int, Parity] = {}
+        self.recovered = 0
+
+    def data(self, packet_id: int, start: int, payload: Buffer) -> List[Tuple[int, bytes]]:
+        '''Records a data packet. Returns the packets it lets pending
+        parity rebuild, as (start, payload).'''
+        self.history[packet_id] = (start, payload)
+        if len(self.history) > history_size:
+            del self.history[next(iter(self.history))]
+        rebuilt = []
+        for parity_id in [p for p, parity in self.pending.items() if p - parity[0] <= packet_id < p]:
+            packet = self.parity(parity_id, *self.pending.pop(parity_id))
+            if packet is not None:
+                rebuilt.append(packet)
+        return rebuilt
+
+    def parity(self, parity_id: int, count: int, start_len: int, payload: Buffer) -> Optional[Tuple[int, bytes]]:
+        '''Handles a parity packet. Returns the rebuilt member, if exactly
+        one is missing.'''
+        missing = [i for i in range(parity_id - count, parity_id) if i not in self.history]
+        if not missing:
+            return None
+        if len(missing) > 1:
+            self.pending[parity_id] = (count, start_len, payload)
+            if len(self.pending) > max_pending:
+                del self.pending[next(iter(self.pending))]
+            return None
+        acc = int.from_bytes(payload, "little")
+        for i in range(parity_id - count, parity_id):
+            if i != missing[0]:
+                start, data = self.history[i]
+                acc = _xor_into(acc, data)
+                start_len ^= start ^ (len(data) << 48)
+        start, length = start_len & ((1 << 48) - 1), start_len >> 48
+        if length > len(payload) or acc.bit_length() > 8 * len(payload):
+            # Members longer than the parity: not a parity of this group
+            return None
+        data = acc.to_bytes(len(payload), "little")[:length]
+        # Like any other arrival, so a later parity can use it too
+        self.history[missing[0]] = (start, data)
+        self.recovered += 1
+        return start, data
@@ -4,56 +4,17 @@ import random
 import socket
 import time
 
-payload_size = 1200
-packet_size = 1500
-
-class Sender:
-    def __init__(self, data_len: int, const_cwnd_pkts: int):
-        self.data_len = data_len
-        self.min_adj_ack = 0
-        self.next_adj_send_idx = 0
-        self.acked_packets = [False] * (data_len // payload_size + 1)
-        # Constant congestion window in bytes
-        self.cwnd = const_cwnd_pkts * packet_size
-        self.send_times = {}
-
-    def timeout(self):
-        self.next_adj_send_idx = self.min_adj_ack
-        # Nothing else needed for constant cwnd
-
-    def ack_packet(self, sacks, packet_id):
-        ack_size = 0
-        for sack in sacks:
-            for idx in range(sack[0], sack[1], payload_size):
-                adj_idx = idx // payload_size
-                if not self.acked_packets[adj_idx]:
-                    self.acked_packets[adj_idx] = True
-                    ack_size += min(payload_size, self.data_len - idx)
-        while self.min_adj_ack < len(self.acked_packets) and self.acked_packets[self.min_adj_ack]:
-            self.min_adj_ack += 1
-        return ack_size
-
-    def send(self, packet_id):
-        if self.min_adj_ack >= len(self.acked_packets):
-            return None
+import wire
+from congestion import FixedWindow
+from source import FileSource
+from transport import Sender
 
-        while self.next_adj_send_idx < len(self.acked_packets) and self.acked_packets[self.next_adj_send_idx]:
-            self.next_adj_send_idx += 1
-
-        if self.next_adj_send_idx >= len(self.acked_packets):
-            return (self.data_len, self.data_len)
-
-        start = self.next_adj_send_idx * payload_size
-        end = min((self.next_adj_send_idx + 1) * payload_size, self.data_len)
-        self.next_adj_send_idx += 1
-        self.send_times[packet_id] = time.time()
-        return (start, end)
-
-    def get_cwnd(self):
-        return self.cwnd
+packet_size = 1500
 
 def start_sender(ip, port, data, recv_window, simloss, const_cwnd_pkts):
-    sender = Sender(len(data), const_cwnd_pkts)
+    # Smaller payloads for files that are not text, which JSON escapes
+    payload_size = wire.max_payload(wire.WIRE_JSON, packet_size, text=wire.is_text(data))
+    sender = Sender(len(data), payload_size, FixedWindow(packet_size, const_cwnd_pkts))
     start_time = time.time()
     total_bytes_sent = 0  # Count unique bytes successfully delivered
 
@@ -76,9 +37,7 @@ def start_sender(ip, port, data, recv_window, simloss, const_cwnd_pkts):
                     continue
 
                 if random.random() >= simloss:
-                    client_socket.send(json.dumps({
-                        "type": "data", "seq": seq, "id": packet_id, "payload": data[seq[0]:seq[1]]
-                    }).encode())
+                    client_socket.send(wire.encode_data(wire.WIRE_JSON, seq, packet_id, data[seq[0]:seq[1]]))
                     total_bytes_sent += seq[1] - seq[0]
 
                 inflight += seq[1] - seq[0]
@@ -119,10 +78,9 @@ def main():
         if args.sendfile is None:
             print("No file to send")
             return
-        with open(args.sendfile, 'r') as f:
-            data = f.read()
-        for const_cwnd_pkts in range(200, 201):
-            start_sender(args.ip, args.port, data, args.recv_window, args.simloss, const_cwnd_pkts)
+        with FileSource(args.sendfile) as data:
+            for const_cwnd_pkts in range(200, 201):
+                start_sender(args.ip, args.port, data, args.recv_window, args.simloss, const_cwnd_pkts)
 
 if __name__ == "__main__":
     main()
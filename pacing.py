@@ -0,0 +1,46 @@
+import time
+from typing import Optional
+
+# Below this delay, waiting on the socket is too coarse (poll() works in
+# milliseconds), so the sender polls for ACKs in a tight loop instead
+spin_threshold = 0.001
+
+
+class Pacer:
+    '''Token bucket that spreads packets out at a given rate.
+
+    Tokens are bytes. They accumulate at `rate` bytes per second, measured
+    with `time.perf_counter`, up to `burst` bytes, and each packet spends
+    its size in tokens. A sender that may put a whole window on the wire
+    at once thus sends it as a smooth stream instead of a line-rate
+    burst that overflows the bottleneck queue. Without a rate (before
+    the first RTT sample) nothing is held back.
+
+    '''
+
+    def __init__(self, burst: int):
+        self.burst = burst
+        self.tokens = float(burst)
+        self.rate: Optional[float] = None
+        self.last = time.perf_counter()
+
+    def set_rate(self, rate: Optional[float]):
+        self.refill()
+        self.rate = rate
+
+    def refill(self):
+        now = time.perf_counter()
+        if self.rate is not None:
+            self.tokens = min(float(self.burst), self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def delay(self, size: int) -> float:
+        '''Seconds until a packet of `size` bytes may be sent.'''
+        self.refill()
+        if self.rate is None or self.tokens >= size:
+            return 0.0
+        return (size - self.tokens) / self.rate
+
+    def consume(self, size: int):
+        if self.rate is not None:
+            self.tokens -= size
@@ -1,224 +1,195 @@
-import matplotlib.pyplot as plt
-
-# (x, y) pairs from your dataset
-data = """
-1 51506
-2 103277
-3 154032
-4 204825
-5 306890
-6 358557
-7 409038
-8 460673
-9 559298
-10 609794
-11 658904
-12 705016
-13 803733
-14 854567
-15 900987
-16 948325
-17 1044571
-18 1084917
-19 1133561
-20 1168555
-21 538441
-22 526490
-23 541443
-24 542472
-25 544866
-26 544391
-27 552953
-28 546464
-29 548290
-30 548125
-31 549290
-32 549042
-33 551692
-34 551230
-35 558783
-36 560513
-37 553953
-38 561660
-39 555485
-40 556128
-41 362698
-42 363383
-43 364647
-44 365049
-45 366677
-46 367409
-47 367301
-48 369176
-49 370594
-50 372369
-51 372476
-52 375059
-53 375219
-54 375751
-55 376862
-56 380025
-57 379182
-58 380510
-59 380375
-60 381781
-61 284289
-62 284527
-63 284778
-64 285906
-65 287216
-66 288472
-67 288825
-68 290390
-69 292771
-70 293280
-71 293902
-72 294817
-73 296320
-74 297737
-75 298938
-76 299471
-77 302331
-78 302461
-79 303015
-80 304288
-81 305964
-82 306814
-83 243414
-84 244090
-85 246052
-86 246600
-87 247408
-88 247483
-89 249177
-90 251215
-91 252900
-92 252938
-93 254463
-94 256228
-95 256947
-96 257397
-97 260360
-98 260287
-99 262103
-100 263034
-101 264502
-102 265429
-103 266707
-104 266900
-105 268940
-106 223695
-107 224132
-108 224769
-109 227888
-110 228846
-111 227304
-112 229367
-113 233425
-114 231778
-115 234124
-116 235194
-117 230869
-118 227771
-119 229425
-120 229702
-121 231530
-122 241630
-123 242616
-124 243255
-125 240807
-126 245882
-127 247400
-128 211785
-129 216438
-130 213721
-131 215755
-132 216741
-133 217903
-134 218917
-135 220458
-136 221041
-137 222178
-138 223277
-139 223376
-140 225250
-141 226980
-142 227401
-143 228651
-144 230113
-145 229130
-146 232078
-147 231591
-148 234570
-149 234150
-150 234643
-151 236651
-152 237434
-153 237674
-154 238659
-155 235873
-156 236717
-157 241153
-158 239722
-159 237323
-160 214819
-161 217830
-162 217794
-163 218414
-164 220312
-165 221778
-166 222033
-167 226278
-168 224742
-169 226889
-170 227458
-171 228224
-172 228972
-173 229170
-174 232071
-175 232947
-176 233967
-177 229605
-178 235678
-179 210361
-180 215190
-181 211932
-182 213004
-183 212603
-184 216552
-185 215957
-186 217117
-187 220430
-188 220123
-189 222969
-190 223296
-191 222976
-192 223941
-193 226258
-194 225336
-195 227261
-196 228632
-197 230171
-198 231511
-199 230543
-200 221826
-"""
-
-xs = []
-ys = []
-
-for line in data.strip().split("\n"):
-    x, y = line.split()
-    xs.append(int(x))
-    ys.append(int(y))
-
-plt.figure(figsize=(12, 5))
-plt.plot(xs, ys, linewidth=2)
-plt.ticklabel_format(style='plain', axis='y')
-plt.xlabel("Congestion Window Size (packets, 1500 bytes)")
-plt.ylabel("Goodput (bytes/sec)")
-plt.title("Congestion Window Size vs. Goodput")
-plt.grid(True)
-plt.tight_layout()
-plt.savefig("goodput_plot.pdf", format="pdf", bbox_inches="tight")
-plt.show()
+import argparse
+import json
+import os
+import statistics
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Plots benchmark results straight from their files:
+#
+# - "goodput": one line per group of results (e.g. per CC algorithm or
+#   link trace), the mean over repeats with a band between two
+#   percentiles. Results are JSONL (as written by sweep.py) or plain text
+#   with one whitespace-separated record per line, like
+#   goodput_sampling_results.txt ("cwnd goodput").
+# - "timeseries": how fields such as cwnd and RTT evolve during one
+#   transfer, from JSONL transfer traces with a "t" field, one plot per
+#   field and one line per file.
+#
+# Files are read in a single streaming pass that only keeps the y values
+# of each (group, x) point.
+
+# Column names of plain text results, in order
+text_columns = ("cwnd", "goodput")
+
+# Axis labels of well-known fields
+labels = {
+    "cwnd": "Congestion Window Size (packets, 1500 bytes)",
+    "goodput": "Goodput (bytes/sec)",
+    "loss": "Loss rate",
+    "recv_window": "Receive window (bytes)",
+    "rtt": "RTT (seconds)",
+    "t": "Time (seconds)",
+}
+
+Point = Tuple[Any, ...]
+
+
+def read_records(path: str, columns: Sequence[str] = text_columns) -> Iterator[Dict[str, Any]]:
+    '''Yields the records of a results file one at a time. Lines starting
+    with '{' are JSON objects; other lines are whitespace-separated values
+    named by `columns`. Blank lines, comments and lines that do not parse
+    are skipped.'''
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+                continue
+            values = line.split()
+            if len(values) != len(columns):
+                continue
+            try:
+                yield {column: float(value) for column, value in zip(columns, values)}
+            except ValueError:
+                continue
+
+
+def matches(record: Dict[str, Any], where: Dict[str, str]) -> bool:
+    return all(str(record.get(key)) == value for key, value in where.items())
+
+
+def collect(paths: Sequence[str], x: str, y: str, group: Sequence[str], where: Dict[str, str],
+            columns: Sequence[str] = text_columns) -> Dict[Point, Dict[float, List[float]]]:
+    '''Groups the `y` values of every record by the values of its `group`
+    fields, then by its `x` value.'''
+    series: Dict[Point, Dict[float, List[float]]] = {}
+    for path in paths:
+        for record in read_records(path, columns):
+            if record.get(x) is None or record.get(y) is None or not matches(record, where):
+                continue
+            key = tuple(record.get(field) for field in group)
+            series.setdefault(key, {}).setdefault(record[x], []).append(record[y])
+    return series
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    '''The `p`th percentile (0-100) of sorted `values`, interpolating
+    linearly between neighbours.'''
+    position = (len(values) - 1) * p / 100.0
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def summarize(points: Dict[float, List[float]], band: Tuple[float, float]) -> Tuple[List[float], List[float], List[float], List[float]]:
+    '''xs, means and the two band percentiles of one series.'''
+    xs = sorted(points)
+    means, lows, highs = [], [], []
+    for x in xs:
+        values = sorted(points[x])
+        means.append(statistics.mean(values))
+        lows.append(percentile(values, band[0]))
+        highs.append(percentile(values, band[1]))
+    return xs, means, lows, highs
+
+
+def series_label(group: Sequence[str], key: Point) -> Optional[str]:
+    if not group:
+        return None
+    return " ".join(f"{field}={value}" for field, value in zip(group, key))
+
+
+def plot_goodput(args: argparse.Namespace):
+    import matplotlib.pyplot as plt
+
+    where = dict(condition.split("=", 1) for condition in args.where)
+    series = collect(args.files, args.x, args.y, args.group, where, args.columns)
+    if not series:
+        raise SystemExit("No matching records")
+
+    plt.figure(figsize=(12, 5))
+    for key in sorted(series, key=lambda key: tuple(str(value) for value in key)):
+        xs, means, lows, highs = summarize(series[key], args.band)
+        line, = plt.plot(xs, means, linewidth=2, label=series_label(args.group, key))
+        if any(len(values) > 1 for values in series[key].values()):
+            plt.fill_between(xs, lows, highs, color=line.get_color(), alpha=0.2, linewidth=0)
+    plt.ticklabel_format(style='plain', axis='y')
+    plt.xlabel(labels.get(args.x, args.x))
+    plt.ylabel(labels.get(args.y, args.y))
+    plt.title(args.title or f"{labels.get(args.x, args.x)} vs. {labels.get(args.y, args.y)}")
+    if args.group:
+        plt.legend()
+    plt.grid(True)
+    plt.tight_layout()
+    finish(args)
+
+
+def plot_timeseries(args: argparse.Namespace):
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(len(args.fields), 1, figsize=(12, 3 * len(args.fields)), sharex=True, squeeze=False)
+    for path in args.files:
+        columns: Dict[str, Tuple[List[float], List[float]]] = {field: ([], []) for field in args.fields}
+        for record in read_records(path, ("t",) + tuple(args.fields)):
+            for field in args.fields:
+                if record.get(field) is not None and "t" in record:
+                    columns[field][0].append(record["t"])
+                    columns[field][1].append(record[field])
+        for ax, field in zip(axes[:, 0], args.fields):
+            ax.plot(columns[field][0], columns[field][1], linewidth=1, label=os.path.basename(path))
+    for ax, field in zip(axes[:, 0], args.fields):
+        ax.set_ylabel(labels.get(field, field))
+        ax.grid(True)
+    axes[-1, 0].set_xlabel(labels["t"])
+    if len(args.files) > 1:
+        axes[0, 0].legend()
+    fig.suptitle(args.title or "Transfer trace")
+    fig.tight_layout()
+    finish(args)
+
+
+def finish(args: argparse.Namespace):
+    import matplotlib.pyplot as plt
+
+    plt.savefig(args.out, format=os.path.splitext(args.out)[1][1:] or "pdf", bbox_inches="tight")
+    print(f"Wrote {args.out}")
+    if args.show:
+        plt.show()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plot benchmark results")
+    parser.add_argument("--out", type=str, default="goodput_plot.pdf", help="Output file; the extension picks the format")
+    parser.add_argument("--title", type=str, required=False, help="Plot title")
+    parser.add_argument("--show", action="store_true", help="Also open the plot in a window")
+    kinds = parser.add_subparsers(dest="kind")
+
+    goodput = kinds.add_parser("goodput", help="Goodput (or any y) against a parameter, one line per group")
+    goodput.add_argument("files", nargs="*", default=["goodput_sampling_results.txt"], help="Results files (JSONL or text)")
+    goodput.add_argument("--x", type=str, default="cwnd", help="Field on the x axis")
+    goodput.add_argument("--y", type=str, default="goodput", help="Field on the y axis")
+    goodput.add_argument("--group", type=str, nargs="*", default=[], help="Fields whose values split the results into series, e.g. cc trace")
+    goodput.add_argument("--where", type=str, nargs="*", default=[], help="Only use records with field=value")
+    goodput.add_argument("--band", type=float, nargs=2, default=(10.0, 90.0), help="Percentiles bounding the band drawn around the mean")
+    goodput.add_argument("--columns", type=str, nargs="+", default=list(text_columns), help="Names of the columns of text results")
+
+    timeseries = kinds.add_parser("timeseries", help="Fields of transfer traces over time")
+    timeseries.add_argument("files", nargs="+", help="Transfer traces (JSONL with a 't' field)")
+    timeseries.add_argument("--fields", type=str, nargs="+", default=["cwnd", "rtt"], help="Fields to plot, one plot each")
+
+    args = parser.parse_args()
+    if args.kind == "timeseries":
+        plot_timeseries(args)
+    else:
+        if args.kind is None:
+            # Without arguments, plot the sampled results as before
+            args = goodput.parse_args([], namespace=args)
+        plot_goodput(args)
+
+if __name__ == "__main__":
+    main()
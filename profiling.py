@@ -0,0 +1,109 @@
+import cProfile
+import pstats
+import sys
+import time
+from typing import Dict, Optional
+
+# Phases of the sender and receiver loops that `--profile` times. Time
+# in none of them (the congestion control and window bookkeeping of
+# `Sender.send`, pacing, the loop itself) is reported as "other".
+ENCODE = "encode"          # wire.encode_*
+DECODE = "decode"          # wire.decode
+SACK = "sack"              # Sender.ack_packet
+REASSEMBLY = "reassembly"  # Receiver.data_packet
+WRITE = "write"            # handing received data to the sink
+SYSCALLS = "syscalls"      # sends, and reads that do not block
+IDLE = "idle"              # blocked waiting for packets or a timeout
+PHASES = (ENCODE, DECODE, SACK, REASSEMBLY, WRITE, SYSCALLS, IDLE)
+
+# Values of --profile
+PROFILE_PHASES = "phases"
+PROFILE_CPROFILE = "cprofile"
+PROFILE_MODES = (PROFILE_PHASES, PROFILE_CPROFILE)
+
+# Functions listed in the cProfile summary
+top_functions = 15
+
+
+class PhaseTimer:
+    '''Wall-clock time spent in each phase since the timer was created.
+
+    The caller reads the clock at the start of a phase and passes it to
+    `add` at its end. `add` returns the time it read, so back-to-back
+    phases need one clock read each:
+
+        t = time.perf_counter()
+        packet = wire.encode_data(...)
+        t = phases.add(ENCODE, t)
+        outgoing.flush()
+        phases.add(SYSCALLS, t)
+
+    '''
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.totals: Dict[str, float] = dict.fromkeys(PHASES, 0.0)
+        self.counts: Dict[str, int] = dict.fromkeys(PHASES, 0)
+
+    def add(self, phase: str, since: float) -> float:
+        now = time.perf_counter()
+        self.totals[phase] += now - since
+        self.counts[phase] += 1
+        return now
+
+    def breakdown(self) -> Dict[str, float]:
+        '''Seconds per phase, plus "other" and "total".'''
+        total = time.perf_counter() - self.start
+        seconds = {phase: self.totals[phase] for phase in PHASES if self.counts[phase]}
+        seconds["other"] = max(0.0, total - sum(seconds.values()))
+        seconds["total"] = total
+        return seconds
+
+    def format(self) -> str:
+        seconds = self.breakdown()
+        total = seconds["total"] or 1e-9
+        parts = []
+        for phase, value in seconds.items():
+            if phase == "total":
+                parts.append(f"total={value:.3f}s")
+            elif phase in self.counts:
+                parts.append(f"{phase}={value:.3f}s({100.0 * value / total:.1f}%,"
+                             f"{1e6 * value / self.counts[phase]:.2f}us/call)")
+            else:
+                parts.append(f"{phase}={value:.3f}s({100.0 * value / total:.1f}%)")
+        return "profile " + " ".join(parts)
+
+
+class Profiler:
+    '''The `--profile` state of one sender or receiver process: phase
+    counters, and with `PROFILE_CPROFILE` also cProfile over everything
+    the process runs. `report` prints the phase breakdown and, under
+    cProfile, writes the stats to `out` in pstats format (readable by
+    `python3 -m pstats`, snakeviz, or flameprof/gprof2dot for flame
+    graphs).
+
+    '''
+
+    def __init__(self, mode: str, out: Optional[str] = None):
+        self.phases = PhaseTimer()
+        self.profile = cProfile.Profile() if mode == PROFILE_CPROFILE else None
+        self.out = out
+        if self.profile is not None:
+            self.profile.enable()
+
+    def report(self, summary: bool = True):
+        '''Prints the phase breakdown so far. Under cProfile, also writes
+        `out` and, with `summary`, prints the functions with the most
+        cumulative time. Profiling goes on afterwards.'''
+        print(self.phases.format())
+        if self.profile is None:
+            return
+        self.profile.disable()
+        try:
+            if self.out:
+                self.profile.dump_stats(self.out)
+                print(f"profile written to {self.out}")
+            if summary:
+                pstats.Stats(self.profile, stream=sys.stdout).sort_stats("cumulative").print_stats(top_functions)
+        finally:
+            self.profile.enable()
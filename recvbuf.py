@@ -0,0 +1,75 @@
+from typing import List, Optional
+
+# Initial size of a connection's receive buffer. It doubles whenever a
+# packet lands further ahead of the application than the buffer can hold,
+# up to its `max_capacity`.
+initial_capacity = 1 << 20
+
+
+class ReceiveBuffer:
+    '''Ring buffer that stores received bytes at their sequence offset.
+
+    Byte `seq` lives at `buf[seq % capacity]`. Everything before `base`
+    has been handed to the application and its space may be reused, so
+    the buffer only has to cover the window [base, base + capacity).
+    Which bytes in that window are actually present is tracked
+    separately by the caller (`Receiver` keeps an interval index).
+
+    '''
+
+    def __init__(self, capacity: int = initial_capacity, max_capacity: Optional[int] = None):
+        self.capacity = capacity
+        self.buf = bytearray(capacity)
+        self.base = 0
+        # Doubling stops here (the caller's window), though a write that
+        # needs more still gets it
+        self.max_capacity = max_capacity
+
+    def write(self, start: int, data: bytes):
+        '''Copies `data` into the buffer at sequence number `start`.
+        `start` must not be below `base`.'''
+        data = memoryview(data)
+        end = start + len(data)
+        if end - self.base > self.capacity:
+            self._grow(end - self.base)
+        pos = start % self.capacity
+        first = min(len(data), self.capacity - pos)
+        self.buf[pos:pos + first] = data[:first]
+        if first < len(data):
+            self.buf[:len(data) - first] = data[first:]
+
+    def read(self, start: int, end: int) -> List[memoryview]:
+        '''Returns the bytes [start, end) as one or two memoryviews into
+        the buffer (two when the range wraps around its end). No data is
+        copied, so the views are only valid until the space is reused:
+        consume them before the next `write`.'''
+        if start >= end:
+            return []
+        view = memoryview(self.buf)
+        pos = start % self.capacity
+        length = end - start
+        if pos + length <= self.capacity:
+            return [view[pos:pos + length]]
+        return [view[pos:], view[:pos + length - self.capacity]]
+
+    def release(self, end: int):
+        '''Marks everything before `end` as delivered.'''
+        self.base = max(self.base, end)
+
+    def resize(self, capacity: int):
+        '''Reallocates the buffer to hold `capacity` bytes. Only the bytes
+        in [base, base + capacity) are kept.'''
+        # Views handed out earlier keep the old bytearray alive, so we
+        # allocate a new one rather than resizing in place
+        old = b"".join(self.read(self.base, self.base + min(self.capacity, capacity)))
+        self.capacity = capacity
+        self.buf = bytearray(capacity)
+        self.write(self.base, old)
+
+    def _grow(self, needed: int):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        if self.max_capacity is not None:
+            capacity = max(needed, min(capacity, self.max_capacity))
+        self.resize(capacity)
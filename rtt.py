@@ -0,0 +1,48 @@
+import bisect
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+# How long RTT samples count towards the minimum and the percentiles
+# (seconds). Like BBR's min-RTT filter, long enough to span a few
+# congestion episodes, short enough to follow a route change.
+window = 10.0
+# Upper bound on the samples kept, so that a fast link does not make
+# percentile updates slow
+max_samples = 4096
+
+
+class RttWindow:
+    '''The RTT samples of the last `window` seconds, for the minimum and
+    percentiles of the recent RTT.
+
+    Samples are kept both in arrival order, to expire them, and sorted, so
+    that `percentile` is a single index. `min_rtt` is the first sorted
+    sample.
+
+    '''
+
+    def __init__(self, window: float = window, max_samples: int = max_samples):
+        self.window = window
+        self.max_samples = max_samples
+        self.samples: Deque[Tuple[float, float]] = deque()
+        self.sorted: List[float] = []
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def add(self, rtt: float, now: float):
+        self.samples.append((now, rtt))
+        bisect.insort(self.sorted, rtt)
+        while self.samples and (now - self.samples[0][0] > self.window or len(self.samples) > self.max_samples):
+            _, old = self.samples.popleft()
+            del self.sorted[bisect.bisect_left(self.sorted, old)]
+
+    @property
+    def min_rtt(self) -> Optional[float]:
+        return self.sorted[0] if self.sorted else None
+
+    def percentile(self, p: float) -> Optional[float]:
+        '''The `p`th percentile (0-100) of the samples in the window.'''
+        if not self.sorted:
+            return None
+        return self.sorted[min(len(self.sorted) - 1, int(p / 100.0 * len(self.sorted)))]
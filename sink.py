@@ -0,0 +1,89 @@
+import os
+import queue
+import threading
+from typing import List, Optional, Tuple
+
+# Deliveries are gathered until this many bytes are pending, then written
+# with a single system call
+flush_size = 1 << 20
+# Number of full buffers that may wait for the disk before `write` blocks
+max_queued_buffers = 64
+
+
+class FileSink:
+    '''Streams one connection's in-order data to a file.
+
+    Small deliveries are coalesced into `flush_size` buffers, which a
+    background thread writes with `os.pwrite` at their offset in the
+    stream. The receive loop only copies bytes into the pending buffer,
+    so a slow disk does not stall it until `max_queued_buffers` are
+    waiting. Writing at offsets also makes a late duplicate of an old
+    packet harmless: it rewrites the same bytes in the same place.
+
+    The file is truncated to the stream length and fsync'ed by `close`,
+    which the receiver calls on `fin`.
+
+    A stream may also fill only part of a file, starting at `offset`, as
+    one stripe of a striped transfer does. Several sinks (possibly in
+    different processes) then write to the same file, and only the one
+    that ends the file should `truncate` it.
+
+    '''
+
+    def __init__(self, path: str, offset: int = 0, truncate: bool = True):
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+        self.truncate = truncate
+        # File offset of the first byte in `pending`
+        self.position = offset
+        self.pending = bytearray()
+        self.queue: "queue.Queue[Optional[Tuple[int, bytearray]]]" = queue.Queue(max_queued_buffers)
+        self.error: Optional[OSError] = None
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def write(self, chunks: List[memoryview]):
+        '''Appends `chunks` to the stream. They are copied, so the caller
+        may reuse their memory straight away.'''
+        for chunk in chunks:
+            self.pending += chunk
+        if len(self.pending) >= flush_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.queue.put((self.position, self.pending))
+            self.position += len(self.pending)
+            self.pending = bytearray()
+
+    def close(self):
+        '''Writes out everything, truncates the file to the end of the
+        stream (if `truncate`) and syncs it to disk.'''
+        self.flush()
+        self.queue.put(None)
+        self.writer.join()
+        try:
+            if self.error is not None:
+                raise self.error
+            if self.truncate:
+                os.ftruncate(self.fd, self.position)
+            os.fsync(self.fd)
+        finally:
+            os.close(self.fd)
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                # Keep draining so `write` never blocks on a dead writer
+                continue
+            offset, buf = item
+            view = memoryview(buf)
+            try:
+                while view:
+                    written = os.pwrite(self.fd, view, offset)
+                    view = view[written:]
+                    offset += written
+            except OSError as e:
+                self.error = e
@@ -0,0 +1,78 @@
+import mmap
+import os
+from typing import Optional
+
+# Size of the chunks read when the file cannot be memory-mapped
+chunk_size = 1 << 20
+
+
+class FileSource:
+    '''Read-only, zero-copy access to the file being sent.
+
+    The file is opened in binary mode and memory-mapped, so any kind of
+    file works and nothing is loaded up front: `source[start:end]`
+    returns a `memoryview` into the mapping and the OS pages data in as
+    packets are sent. Files that cannot be mapped (empty files, some
+    special files) are read lazily in `chunk_size` chunks instead.
+
+    '''
+
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.map: Optional[mmap.mmap] = None
+        self.view: Optional[memoryview] = None
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.map)
+        except (ValueError, OSError):
+            pass
+        # The most recently read chunk, when not memory-mapped
+        self.chunk_start = 0
+        self.chunk = memoryview(b"")
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, key: slice) -> memoryview:
+        if self.view is not None:
+            return self.view[key]
+        start, stop, _ = key.indices(self.size)
+        if start < self.chunk_start or stop > self.chunk_start + len(self.chunk):
+            # Packets are mostly requested in order, so read ahead a chunk
+            self.chunk_start = start
+            self.chunk = memoryview(os.pread(self.file.fileno(), max(chunk_size, stop - start), start))
+        return self.chunk[start - self.chunk_start:stop - self.chunk_start]
+
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def __enter__(self) -> "FileSource":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SourceRange:
+    '''The `length` bytes of `source` starting at `offset`, indexed from 0.
+    Lets a flow that carries one stripe of a file treat it as a whole
+    file of its own.'''
+
+    def __init__(self, source: FileSource, offset: int, length: int):
+        self.source = source
+        self.offset = offset
+        self.length = length
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, key: slice) -> memoryview:
+        start, stop, _ = key.indices(self.length)
+        return self.source[self.offset + start:self.offset + stop]
@@ -0,0 +1,229 @@
+import argparse
+import contextlib
+import itertools
+import json
+import multiprocessing
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import wire
+from congestion import CONTROLLERS, CC_AIMD, CC_FIXED, make_controller
+from emulator import Emulation, Trace, max_duration
+from source import FileSource
+from transport import format_stats, packet_size, start_sender
+
+# Runs a grid of goodput experiments and appends one JSON object per run
+# to a results file. A run is identified by its parameters and repeat
+# number, so re-running the same command skips the runs already in the
+# file: an interrupted sweep resumes where it stopped.
+#
+# Two modes:
+# - "emulator": each run is an `emulator.Emulation`, so runs are
+#   independent and any number can run in parallel. The repeat number is
+#   the seed of the random losses.
+# - "socket": each run starts its own receiver process on its own port
+#   and sends `--sendfile` to it with `transport.start_sender`. Link
+#   traces do not apply; the path is whatever `--ip` leads to.
+
+MODE_EMULATOR = "emulator"
+MODE_SOCKET = "socket"
+
+# Parameters that, with the repeat number, identify a run
+KEY_FIELDS = ("mode", "cc", "cwnd", "loss", "recv_window", "trace", "delay", "queue_bytes", "wire", "sendfile", "size",
+              "repeat")
+
+# Seconds to wait for a receiver process to bind its port
+receiver_startup = 0.5
+# Default of --run_timeout: seconds a socket run may take before it is
+# abandoned and recorded as failed
+run_timeout = 300.0
+# Normal-approximation multiplier for 95% confidence intervals
+z_95 = 1.96
+
+
+def run_key(run: Dict[str, Any]) -> Tuple[Any, ...]:
+    return tuple(run.get(field) for field in KEY_FIELDS)
+
+
+def describe(key: Tuple[Any, ...]) -> str:
+    return " ".join(f"{field}={value}" for field, value in zip(KEY_FIELDS, key) if value is not None)
+
+
+def grid(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    '''Every run of the sweep. The window only varies for the fixed
+    window controller; other controllers get `cwnd` None. Fields that do
+    not apply to the mode (the link in socket mode, the wire format and
+    file in emulator mode) are None too.'''
+    runs = []
+    emulated = args.mode == MODE_EMULATOR
+    # Paths are absolute, so a sweep resumed from another directory finds
+    # the runs already done
+    traces: Iterable[Optional[str]] = [os.path.abspath(trace) for trace in args.trace] if emulated else [None]
+    for cc, loss, recv_window, trace in itertools.product(args.cc, args.loss, args.recv_window, traces):
+        for cwnd in (args.cwnd if cc == CC_FIXED else [None]):
+            for repeat in range(args.repeats):
+                runs.append({
+                    "mode": args.mode, "cc": cc, "cwnd": cwnd, "loss": loss, "recv_window": recv_window,
+                    "trace": trace, "delay": args.delay if emulated else None,
+                    "queue_bytes": args.queue_bytes if emulated else None,
+                    "wire": None if emulated else args.wire,
+                    "sendfile": None if emulated else os.path.abspath(args.sendfile),
+                    "size": args.size if emulated else os.path.getsize(args.sendfile),
+                    "repeat": repeat,
+                })
+    return runs
+
+
+def load_done(path: str) -> set:
+    '''Keys of the runs already in the results file. A line cut short by
+    an interrupted write is ignored, and so is a run that failed, so
+    those runs are simply redone.'''
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if "error" not in result:
+                done.add(run_key(result))
+    return done
+
+
+class RunTimedOut(Exception):
+    '''A run took longer than its timeout. Neither an OSError nor a
+    TimeoutError (which is `socket.timeout`), which the sender's socket
+    code handles itself.'''
+
+
+def run_emulated(run: Dict[str, Any]) -> Dict[str, Any]:
+    emulation = Emulation(run["size"], Trace.load(run["trace"]), run["delay"] / 1000.0, run["queue_bytes"] or None,
+                          run["loss"], run["cc"], run["cwnd"] or 0, run["recv_window"], seed=run["repeat"])
+    stats = emulation.run()
+    if not stats["finished"]:
+        # Failed like a socket run that times out, so it is retried
+        raise RunTimedOut(f"Transfer did not finish in {max_duration}s of emulated time")
+    return stats
+
+
+def _timed_out(signum, frame):
+    raise RunTimedOut("Run timed out")
+
+
+def run_socket(run: Dict[str, Any], ip: str, port: int, timeout: float = run_timeout) -> Dict[str, Any]:
+    '''Raises OSError if the receiver does not start (e.g. the port is
+    taken) and RunTimedOut if the run takes longer than `timeout`
+    seconds.'''
+    receiver = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "transport.py"),
+                                 "--ip", ip, "--port", str(port), "--recv_budget", str(run["recv_window"]),
+                                 "receiver"],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Pool workers run tasks on their main thread, so an alarm can
+    # interrupt a sender that never finishes
+    previous = signal.signal(signal.SIGALRM, _timed_out)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        time.sleep(receiver_startup)
+        if receiver.poll() is not None:
+            raise OSError(f"Receiver on port {port} exited with status {receiver.returncode}")
+        timed_out = False
+        with FileSource(run["sendfile"]) as data, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            start = time.time()
+            try:
+                start_sender(ip, port, data, run["recv_window"], run["loss"], run["wire"],
+                             cc=make_controller(run["cc"], packet_size, run["cwnd"]))
+            except RunTimedOut:
+                # Raised again once the file is closed: until the handler
+                # ends, the traceback holds views into its mapping
+                timed_out = True
+            duration = time.time() - start
+        if timed_out:
+            raise RunTimedOut(f"Run timed out after {timeout}s")
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+        receiver.terminate()
+        receiver.wait()
+    return {"duration": duration, "goodput": run["size"] / duration if duration > 0 else 0.0}
+
+
+def run_one(job: Tuple[int, Dict[str, Any], argparse.Namespace]) -> Dict[str, Any]:
+    '''Body of one pool task. Socket runs each get their own port.'''
+    index, run, args = job
+    try:
+        if run["mode"] == MODE_EMULATOR:
+            stats = run_emulated(run)
+        else:
+            stats = run_socket(run, args.ip, args.base_port + index, args.run_timeout)
+    except (OSError, RunTimedOut) as e:
+        stats = {"error": str(e)}
+    return {**run, **stats}
+
+
+def summarize(path: str):
+    '''Prints the mean goodput of every point of the results file, with a
+    95% confidence interval over its repeats.'''
+    points: Dict[Tuple[Any, ...], List[float]] = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if "goodput" in result:
+                points.setdefault(run_key(result)[:-1], []).append(result["goodput"])
+    for key, goodputs in sorted(points.items(), key=lambda item: tuple(str(v) for v in item[0])):
+        mean = statistics.mean(goodputs)
+        ci = z_95 * statistics.stdev(goodputs) / len(goodputs) ** 0.5 if len(goodputs) > 1 else 0.0
+        print(describe(key), format_stats({"runs": len(goodputs), "goodput": mean, "ci95": ci}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a grid of goodput experiments")
+    parser.add_argument("--mode", choices=(MODE_EMULATOR, MODE_SOCKET), default=MODE_EMULATOR, help="Run over the link emulator or over real sockets")
+    parser.add_argument("--out", type=str, default="sweep_results.jsonl", help="JSONL file results are appended to. Runs already in it are skipped")
+    parser.add_argument("--cc", choices=sorted(CONTROLLERS), nargs="+", default=[CC_AIMD], help="Congestion control algorithms")
+    parser.add_argument("--cwnd", type=int, nargs="+", default=[200], help="Windows, in packets, for --cc fixed")
+    parser.add_argument("--loss", type=float, nargs="+", default=[0.0], help="Loss rates (link loss when emulated, --simloss over sockets)")
+    parser.add_argument("--recv_window", type=int, nargs="+", default=[15000000], help="Receive windows in bytes")
+    parser.add_argument("--trace", type=str, nargs="+", default=["12mbps"], help="If mode=emulator, Mahimahi link traces")
+    parser.add_argument("--delay", type=float, default=10.0, help="If mode=emulator, one-way delay in milliseconds")
+    parser.add_argument("--queue_bytes", type=int, default=30000, help="If mode=emulator, droptail queue limit in bytes (0 for unlimited)")
+    parser.add_argument("--size", type=int, default=1000000, help="If mode=emulator, bytes per transfer")
+    parser.add_argument("--sendfile", type=str, required=False, help="If mode=socket, the file to send")
+    parser.add_argument("--ip", type=str, default="127.0.0.1", help="If mode=socket, the address receivers bind and senders connect to")
+    parser.add_argument("--base_port", type=int, default=20000, help="If mode=socket, run i uses port base_port + i")
+    parser.add_argument("--wire", choices=wire.WIRE_FORMATS, default=wire.WIRE_JSON, help="If mode=socket, the packet format")
+    parser.add_argument("--run_timeout", type=float, default=run_timeout, help="If mode=socket, seconds after which a run is abandoned and recorded as failed, to be retried by the next sweep")
+    parser.add_argument("--repeats", type=int, default=1, help="Runs per grid point")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Runs in parallel")
+    args = parser.parse_args()
+
+    if args.mode == MODE_SOCKET and args.sendfile is None:
+        parser.error("--mode socket needs --sendfile")
+
+    runs = grid(args)
+    done = load_done(args.out)
+    pending = [(i, run, args) for i, run in enumerate(runs) if run_key(run) not in done]
+    print(f"{len(runs)} runs, {len(runs) - len(pending)} already done", file=sys.stderr)
+
+    with open(args.out, "a") as out, multiprocessing.Pool(max(1, args.jobs)) as pool:
+        for finished, result in enumerate(pool.imap_unordered(run_one, pending), 1):
+            # One line per run, written as soon as it completes, so an
+            # interrupted sweep loses at most the runs in progress
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            outcome = f"error={result['error']}" if "error" in result else f"goodput={result['goodput']:.3f}"
+            print(f"[{finished}/{len(pending)}] {describe(run_key(result))} {outcome}", file=sys.stderr)
+
+    summarize(args.out)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import json
+import math
+import sys
+from array import array
+from typing import Dict, Iterator, Sequence
+
+# Number of events a ring keeps by default. Older events are overwritten.
+default_capacity = 1 << 16
+
+# First line of the binary dump format, followed by a JSON header line,
+# the event kinds (one byte each) and then each field as a column of
+# native doubles, all in recording order
+BINARY_MAGIC = b"TLM1\n"
+
+# Event kinds
+SEND = 0
+ACK = 1
+LOSS = 2
+TIMEOUT = 3
+DATA = 4
+KINDS = ("send", "ack", "loss", "timeout", "data")
+
+SENDER_FIELDS = ("t", "cwnd", "ssthresh", "inflight", "rtt", "rto", "retransmits", "timeouts", "sack_blocks")
+RECEIVER_FIELDS = ("t", "seq_start", "seq_end", "delivered", "buffer_span", "buffer_capacity", "segments",
+                   "sack_blocks")
+# Fields exported as floats; the others are counts and sizes
+FLOAT_FIELDS = ("t", "rtt", "rto")
+
+
+class Telemetry:
+    '''A fixed-size ring of events, one column per field.
+
+    Every column is an `array('d')` allocated up front, so recording an
+    event only overwrites numbers in place: nothing grows and nothing is
+    allocated per event. Once `capacity` events have been recorded, each
+    new one replaces the oldest. Fields without a value for an event
+    (e.g. `rtt` when an ACK gave no sample) hold NaN.
+
+    Recording is the owner's job (see `Sender.telemetry` and
+    `Receiver.telemetry`), which only happens when a ring is attached,
+    so telemetry costs one `is None` check per event when turned off.
+
+    '''
+
+    def __init__(self, fields: Sequence[str], capacity: int = default_capacity):
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        self.kinds = array("B", bytes(capacity))
+        self.columns = [array("d", bytes(8 * capacity)) for _ in self.fields]
+        # Number of events recorded so far, including overwritten ones
+        self.count = 0
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    def slot(self, kind: int) -> int:
+        '''Claims the slot of the next event, sets its kind and returns its
+        index into the columns.'''
+        slot = self.count % self.capacity
+        self.count += 1
+        self.kinds[slot] = kind
+        return slot
+
+    def order(self) -> Iterator[int]:
+        '''Slots of the retained events, oldest first.'''
+        start = self.count - len(self)
+        for i in range(start, self.count):
+            yield i % self.capacity
+
+    def events(self) -> Iterator[Dict[str, object]]:
+        for slot in self.order():
+            event: Dict[str, object] = {"event": KINDS[self.kinds[slot]]}
+            for field, column in zip(self.fields, self.columns):
+                value = column[slot]
+                # NaN means no value; infinite ones (BBR's ssthresh) are
+                # not valid JSON either
+                if math.isfinite(value):
+                    event[field] = value if field in FLOAT_FIELDS else int(value)
+            yield event
+
+    def dump(self, path: str):
+        '''Writes the retained events to `path`: as JSON lines (readable by
+        `plotter.py timeseries`) if it ends in ".jsonl", in the compact
+        binary format otherwise.'''
+        if path.endswith(".jsonl"):
+            with open(path, "w") as f:
+                for event in self.events():
+                    f.write(json.dumps(event) + "\n")
+            return
+        slots = list(self.order())
+        header = {"fields": self.fields, "kinds": KINDS, "count": len(slots), "dropped": self.count - len(slots)}
+        with open(path, "wb") as f:
+            f.write(BINARY_MAGIC)
+            f.write(json.dumps(header).encode() + b"\n")
+            f.write(bytes(self.kinds[slot] for slot in slots))
+            for column in self.columns:
+                array("d", (column[slot] for slot in slots)).tofile(f)
+
+    @classmethod
+    def load(cls, path: str) -> "Telemetry":
+        '''Reads a binary dump back into a ring that holds exactly its
+        events.'''
+        with open(path, "rb") as f:
+            if f.readline() != BINARY_MAGIC:
+                raise ValueError(f"{path} is not a telemetry dump")
+            header = json.loads(f.readline())
+            count = header["count"]
+            telemetry = cls(header["fields"], max(1, count))
+            telemetry.kinds = array("B", f.read(count))
+            for i in range(len(telemetry.columns)):
+                column = array("d")
+                column.fromfile(f, count)
+                telemetry.columns[i] = column
+            telemetry.count = count
+        return telemetry
+
+
+def main():
+    '''Prints a binary dump as JSON lines.'''
+    if len(sys.argv) != 2:
+        sys.exit(f"usage: {sys.argv[0]} DUMP")
+    for event in Telemetry.load(sys.argv[1]).events():
+        print(json.dumps(event))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+from fec import FecEncoder, loss_block, max_group
+
+
+def test_late_acks_are_not_losses():
+    encoder = FecEncoder()
+    for packet_id in range(3 * loss_block):
+        encoder.acked(packet_id)
+    assert encoder.loss == 0.0
+    # ACKs of blocks already sampled, e.g. delayed or duplicated
+    for packet_id in (5, loss_block - 1, 10):
+        encoder.acked(packet_id)
+    for packet_id in range(3 * loss_block, 4 * loss_block):
+        encoder.acked(packet_id)
+    assert encoder.loss == 0.0
+    assert encoder.group_size() == max_group
+
+
+def test_missing_acks_are_losses():
+    encoder = FecEncoder()
+    for packet_id in range(3 * loss_block):
+        if packet_id % 2:
+            encoder.acked(packet_id)
+    assert encoder.loss > 0.0
+    assert encoder.group_size() < max_group
@@ -0,0 +1,66 @@
+import json
+import socket
+
+import wire
+from transport import ReceiverServer, packet_size
+
+
+def make_server() -> ReceiverServer:
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server_socket.bind(("127.0.0.1", 0))
+    return ReceiverServer(server_socket)
+
+
+def test_data_without_id_is_malformed():
+    server = make_server()
+    assert server.handle(b'{"type":"data","seq":[0,3],"payload":"abc"}', ("127.0.0.1", 9000)) is None
+    assert server.malformed == 1
+    assert not server.receivers
+
+
+def test_data_with_non_integer_id_is_malformed():
+    server = make_server()
+    for packet_id in ("zz", 1.5, True, None):
+        packet = {"type": "data", "seq": [0, 3], "id": packet_id, "payload": "abc"}
+        assert server.handle(json.dumps(packet).encode(), ("127.0.0.1", 9000)) is None
+    assert server.malformed == 4
+    assert not server.receivers
+
+
+def test_data_is_acked():
+    server = make_server()
+    ack = server.handle(wire.encode_data(wire.WIRE_JSON, (0, 3), 7, b"abc"), ("127.0.0.1", 9000))
+    received = wire.decode(ack)
+    assert received["id"] == 7
+    assert received["sacks"][0] == [0, 3]
+    assert server.malformed == 0
+
+
+def test_json_parity_is_malformed():
+    server = make_server()
+    for packet in ({"type": "parity"}, {"type": "parity", "id": 1, "count": 1, "start_len": 0, "payload": "a"}):
+        assert server.handle(json.dumps(packet).encode(), ("127.0.0.1", 9000)) is None
+    assert server.malformed == 2
+    assert not server.receivers
+
+
+def test_parity_over_max_group_is_malformed():
+    server = make_server()
+    parity = wire.encode_parity(60000, 50000, 0, b"abc")
+    assert server.handle(parity, ("127.0.0.1", 9000)) is None
+    assert server.malformed == 1
+    assert not server.receivers
+
+
+def test_fec_probe_creates_no_decoder():
+    server = make_server()
+    ack = server.handle(wire.encode_probe(fec=True), ("127.0.0.1", 9000))
+    assert wire.decode(ack)["fec_ok"]
+    assert server.receivers[("127.0.0.1", 9000)].fec is None
+
+
+def test_json_packets_of_binary_data_fit_packet_size():
+    payload = bytes(range(256)) * 8
+    size = wire.max_payload(wire.WIRE_JSON, packet_size, text=wire.is_text(payload))
+    packet = wire.encode_data(wire.WIRE_JSON, (1 << 40, (1 << 40) + size), 1 << 30, payload[:size], ts=1.7e9)
+    assert len(packet) <= packet_size
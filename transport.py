@@ -1,60 +1,128 @@
 import argparse
-import json
+import bisect
+import math
+import multiprocessing
+import os
+import queue
 import random
+import selectors
+import signal
 import socket
+import struct
+import sys
 import time
-from typing import Any, Dict, List, Optional, Tuple
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import wire
+from batchio import BatchReader, BatchSender
+from compress import PayloadPacker, max_span
+from congestion import CONTROLLERS, CC_AIMD, Aimd, CongestionControl, make_controller
+from fec import FecDecoder, FecEncoder
+from recvbuf import ReceiveBuffer, initial_capacity
+from rtt import RttWindow
+from pacing import Pacer, spin_threshold
+from profiling import DECODE, ENCODE, IDLE, PROFILE_MODES, REASSEMBLY, SACK, SYSCALLS, WRITE, Profiler
+from scoreboard import PacketBitmap, SackScoreboard
+from sink import FileSink
+from source import FileSource, SourceRange
+from telemetry import ACK, DATA, LOSS, RECEIVER_FIELDS, SEND, SENDER_FIELDS, TIMEOUT, Telemetry, default_capacity
 
 # Note: In this starter code, we annotate types where
 # appropriate. While it is optional, both in python and for this
 # course, we recommend it since it makes programming easier.
 
-# The maximum size of the data contained within one packet
-payload_size = 1200
+# The maximum size of the data contained within one JSON packet. Binary
+# packets carry up to `wire.max_payload(wire.WIRE_BINARY, packet_size)`
+payload_size = wire.JSON_PAYLOAD_SIZE
 # The maximum size of a packet including all the JSON formatting
 packet_size = 1500
+# The maximum number of out-of-order ranges reported in one ACK, on top
+# of the cumulative (0, app_sent_index) range. Keeps ACKs well below
+# `packet_size` in both wire formats.
+max_sack_blocks = 16
+# The maximum number of queued ACKs the sender reads before sending again
+max_ack_batch = 64
+# Number of packets the pacer lets out back to back
+pacing_burst = 2
+# A packet is considered lost once this many packets sent after it are
+# ACKed (RFC 6675 DupThresh)
+dup_thresh = 3
+# RACK reordering window, as a fraction of the minimum RTT
+rack_reo_fraction = 0.25
+# Bytes past the cumulative ACK one connection's receiver buffers, which
+# it advertises in its ACKs as its window
+recv_budget = 1 << 24
+# Bytes all the connections of one receiver process buffer together.
+# Once their windows would add up to more, each gets an equal share,
+# rounded down to a power of two so that it only changes when the number
+# of connections doubles or halves.
+global_recv_budget = 1 << 28
+# Smallest window a receiver advertises, however many connections share
+# the global budget
+min_recv_window = 64 * packet_size
 
 class Receiver:
 
     class Segment:
-        def __init__(self, start: int, end: int, data: str, next=None):
+        '''A run of received bytes [start, end). The bytes themselves live
+        in the connection's `ReceiveBuffer`.'''
+        def __init__(self, start: int, end: int):
             self.start = start
             self.end = end
-            self.data = data
-            self.next = next
 
         def merge(self, segment) -> bool:
-            '''
-            Assumptions:
-            - segment is not connected already (segment.next = null)
+            '''Absorbs `segment` into this one if the two overlap or
+            touch. Returns False (and changes nothing) otherwise.
             '''
             if not segment or segment.start > self.end or segment.end < self.start:
                 return False
-            if segment.start >= self.start and segment.end <= self.end:
-                return True
-            
-            if self.start > segment.start:
-                self.data = segment.data[:(self.start - segment.start)] + self.data
-            if segment.end > self.end:
-                self.data = self.data + segment.data[(self.end - segment.start):]
             self.start = min(self.start, segment.start)
             self.end = max(self.end, segment.end)
             return True
 
-    def __init__(self):
+    def __init__(self, max_sack_blocks: int = max_sack_blocks, telemetry: Optional[Telemetry] = None,
+                 window: int = recv_budget):
         # TODO: Initialize any variables you want here, like the receive
         # buffer, initial congestion window and initial values for the timeout
         # values
         self.app_sent_index = 0 # Last index sent to application
-        self.segments_head: Optional[Receiver.Segment] = None
+        # Bytes past `app_sent_index` we buffer, and advertise to the
+        # sender. Data beyond it is dropped (see `set_window`).
+        self.window = window
+        self.window_drops = 0
+        # Received bytes, stored at their sequence offset
+        self.buffer = ReceiveBuffer(min(initial_capacity, window), window)
+        # Out-of-order segments, sorted by start and never overlapping or
+        # touching. `segment_starts` mirrors the starts so we can bisect,
+        # and `sack_ranges` mirrors (start, end) so the SACK list is kept
+        # up to date as segments change instead of being rebuilt.
+        self.segments: List[Receiver.Segment] = []
+        self.segment_starts: List[int] = []
+        self.sack_ranges: List[Tuple[int, int]] = []
+
+        # ~=====~ For SACK reporting ~=====~
+        self.max_sack_blocks = max_sack_blocks
+        # Start of the most recently received packets, newest last. Like
+        # TCP, the ACK reports the blocks containing them first.
+        self.recent_seqs: List[int] = []
+        # Largest payload seen, i.e. the sender's packet size. Used as the
+        # unit of the SACK bitmap.
+        self.unit = 0
+        # Ring of RECEIVER_FIELDS events, one per data packet, if recording
+        self.telemetry = telemetry
+        # Recent packets and parity, once the sender uses FEC
+        self.fec: Optional[FecDecoder] = None
 
-    def data_packet(self, seq_range: Tuple[int, int], data: str) -> Tuple[List[Tuple[int, int]], str]:
+    def data_packet(self, seq_range: Tuple[int, int], data: bytes,
+                    packet_id: Optional[int] = None) -> Tuple[List[Tuple[int, int]], List[memoryview]]:
         '''This function is called whenever a data packet is
         received. `seq_range` is the range of sequence numbers
         received: It contains two numbers: the starting sequence
         number (inclusive) and ending sequence number (exclusive) of
         the data received. `data` is a binary string of length
-        `seq_range[1] - seq_range[0]` representing the data.
+        `seq_range[1] - seq_range[0]` representing the data. It is
+        always `bytes`, whichever wire format the packet arrived in.
 
         It should output the list of sequence number ranges to
         acknowledge and any data that is ready to be sent to the
@@ -74,46 +142,182 @@ class Receiver:
         newline etc), so that terminal output can be used to debug the
         program.
 
+        The data for the application is returned as a list of
+        memoryviews into the receive buffer, so nothing is copied. They
+        must be consumed before the next call, which may overwrite them.
+
+        `packet_id` is given for packets covered by FEC parity (see
+        `parity_packet`). They are remembered, and any packet they let
+        waiting parity rebuild is received along with them.
+
         '''
-        incoming_segment: Receiver.Segment = Receiver.Segment(seq_range[0], seq_range[1], data)
-        if self.segments_head is None:
-            self.segments_head = incoming_segment
+        if packet_id is not None:
+            if self.fec is None:
+                self.fec = FecDecoder()
+            rebuilt = self.fec.data(packet_id, seq_range[0], data)
+            if rebuilt:
+                return self.receive_all([(seq_range, data)] +
+                                        [((start, start + len(payload)), payload) for start, payload in rebuilt])
+        start, end = seq_range
+        # Drop anything that was already delivered to the application
+        if start < self.app_sent_index:
+            data = data[self.app_sent_index - start:]
+            start = self.app_sent_index
+        if end - self.app_sent_index > self.window:
+            # Beyond the window we advertised, so the buffer does not
+            # grow past it. The sender retransmits once the window moves.
+            self.window_drops += 1
+            start = end
+        if start >= end:
+            to_ack = [(0, self.app_sent_index)] + self.sack_blocks()
+            if self.telemetry is not None:
+                self.record(seq_range, len(to_ack) - 1)
+            return to_ack, []
+        self.buffer.write(start, data)
+        self.unit = max(self.unit, end - seq_range[0])
+        self.recent_seqs.append(start)
+        if len(self.recent_seqs) > self.max_sack_blocks:
+            del self.recent_seqs[0]
+
+        # Find the segment to merge into with a binary search, instead of
+        # walking the whole list
+        incoming_segment = Receiver.Segment(start, end)
+        idx = bisect.bisect_right(self.segment_starts, start)
+        if idx > 0 and self.segments[idx - 1].merge(incoming_segment):
+            idx -= 1
+            segment = self.segments[idx]
         else:
-            previous_segment = None
-            current_segment = self.segments_head
-            while current_segment:
-                if current_segment.merge(incoming_segment):
-                    if current_segment.next and current_segment.merge(current_segment.next):
-                        current_segment.next = current_segment.next.next
-                    break
-                elif current_segment.start > incoming_segment.end:
-                    incoming_segment.next = current_segment
-                    if previous_segment is None:
-                        self.segments_head = incoming_segment
-                    else:
-                        previous_segment.next = incoming_segment
-                    break
-                previous_segment = current_segment
-                current_segment = current_segment.next
-            if current_segment is None:
-                previous_segment.next = incoming_segment
+            segment = incoming_segment
+            self.segments.insert(idx, segment)
+            self.segment_starts.insert(idx, start)
+            self.sack_ranges.insert(idx, (start, end))
+
+        # The segment may now reach into its right neighbours
+        last = idx + 1
+        while last < len(self.segments) and segment.merge(self.segments[last]):
+            last += 1
+        if last > idx + 1:
+            del self.segments[idx + 1:last]
+            del self.segment_starts[idx + 1:last]
+            del self.sack_ranges[idx + 1:last]
+        self.segment_starts[idx] = segment.start
+        self.sack_ranges[idx] = (segment.start, segment.end)
+
+        # ACK and send data to app. Only the first segment can be in order.
+        to_send: List[memoryview] = []
+        if self.segments[0].start == self.app_sent_index:
+            to_send = self.buffer.read(self.app_sent_index, self.segments[0].end)
+            self.app_sent_index = self.segments[0].end
+            self.buffer.release(self.app_sent_index)
+            del self.segments[0]
+            del self.segment_starts[0]
+            del self.sack_ranges[0]
+            if self.buffer.capacity > self.window:
+                self.fit_buffer()
+
+        to_ack: List[Tuple[int, int]] = [(0, self.app_sent_index)] + self.sack_blocks()
+        if self.telemetry is not None:
+            self.record(seq_range, len(to_ack) - 1)
+        return to_ack, to_send
+
+    def set_window(self, window: int):
+        '''Changes the window. Nothing is reallocated here: data already
+        buffered beyond a smaller one is kept (it has been SACKed), and
+        the buffer shrinks to the window at the next in-order delivery
+        at which what it holds fits.'''
+        self.window = window
+        self.buffer.max_capacity = window
 
-        # ACK and send data to app
-        to_send = ''
-        if self.segments_head.start == self.app_sent_index:
-            to_send = self.segments_head.data
-            self.app_sent_index = self.segments_head.end
-            self.segments_head = self.segments_head.next
+    def fit_buffer(self):
+        '''Shrinks the buffer to the window, if what it holds fits.'''
+        span = self.segments[-1].end - self.app_sent_index if self.segments else 0
+        if span <= self.window:
+            # The views handed out by `data_packet` stay valid: they keep
+            # the old buffer alive
+            self.buffer.resize(self.window)
 
-        it_segment = self.segments_head
-        to_ack: List[Tuple[int, int]] = [(0, self.app_sent_index)]
+    def record(self, seq_range: Tuple[int, int], sack_blocks: int):
+        telemetry = self.telemetry
+        slot = telemetry.slot(DATA)
+        t, seq_start, seq_end, delivered, buffer_span, buffer_capacity, segments, blocks = telemetry.columns
+        t[slot] = time.time()
+        seq_start[slot] = seq_range[0]
+        seq_end[slot] = seq_range[1]
+        delivered[slot] = self.app_sent_index
+        # Bytes the buffer must hold for the out-of-order data
+        buffer_span[slot] = self.segments[-1].end - self.app_sent_index if self.segments else 0
+        buffer_capacity[slot] = self.buffer.capacity
+        segments[slot] = len(self.segments)
+        blocks[slot] = sack_blocks
 
-        while it_segment:
-            to_ack.append((it_segment.start, it_segment.end))
-            it_segment = it_segment.next
+    def parity_packet(self, packet_id: int, count: int, start_len: int,
+                      payload: bytes) -> Tuple[List[Tuple[int, int]], List[memoryview]]:
+        '''Called for an FEC parity packet covering the `count` packets
+        sent before `packet_id` (see fec.py). If exactly one of them is
+        missing, it is rebuilt and received as if it had arrived, so it
+        is ACKed and delivered without waiting for a retransmission.
+        Returns the same as `data_packet`.'''
+        if self.fec is None:
+            self.fec = FecDecoder()
+        rebuilt = self.fec.parity(packet_id, count, start_len, payload)
+        if rebuilt is None:
+            return [(0, self.app_sent_index)] + self.sack_blocks(), []
+        start, data = rebuilt
+        return self.data_packet((start, start + len(data)), data)
 
+    def receive_all(self, packets: List[Tuple[Tuple[int, int], bytes]]) -> Tuple[List[Tuple[int, int]], List[memoryview]]:
+        '''`data_packet` for several packets at once.'''
+        to_ack: List[Tuple[int, int]] = []
+        to_send: List[memoryview] = []
+        for i, (seq_range, data) in enumerate(packets):
+            to_ack, chunks = self.data_packet(seq_range, data)
+            if i < len(packets) - 1:
+                # The next call may overwrite them
+                chunks = [memoryview(bytes(chunk)) for chunk in chunks]
+            to_send += chunks
         return to_ack, to_send
 
+    def sack_blocks(self) -> List[Tuple[int, int]]:
+        '''Returns at most `max_sack_blocks` out-of-order ranges. As in TCP
+        (RFC 2018), the block holding the most recently received packet
+        comes first, followed by the blocks of the packets before it. Any
+        room left is filled with the highest blocks, which tell the
+        sender how far ahead the receiver has got.
+
+        '''
+        blocks: List[Tuple[int, int]] = []
+        for seq in reversed(self.recent_seqs):
+            idx = bisect.bisect_right(self.segment_starts, seq) - 1
+            if idx >= 0 and self.sack_ranges[idx][1] > seq and self.sack_ranges[idx] not in blocks:
+                blocks.append(self.sack_ranges[idx])
+        idx = len(self.sack_ranges) - 1
+        while len(blocks) < self.max_sack_blocks and idx >= 0:
+            if self.sack_ranges[idx] not in blocks:
+                blocks.append(self.sack_ranges[idx])
+            idx -= 1
+        return blocks
+
+    def sack_bitmap(self, max_bits: int) -> Tuple[int, bytes]:
+        '''Compact form of the out-of-order state: bit `i` is set when the
+        bytes [app_sent_index + i * unit, app_sent_index + (i + 1) * unit)
+        have all been received. Covers at most `max_bits` units past the
+        cumulative ACK. Returns the unit and the bitmap, least
+        significant bit first.
+
+        '''
+        bits = 0
+        if self.unit > 0:
+            limit = self.app_sent_index + self.unit * max_bits
+            for segment in self.segments:
+                if segment.start >= limit:
+                    break
+                # Only units that are fully covered by the segment
+                first = -(-(segment.start - self.app_sent_index) // self.unit)
+                last = min((segment.end - self.app_sent_index) // self.unit, max_bits)
+                if last > first:
+                    bits |= ((1 << (last - first)) - 1) << first
+        return self.unit, bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+
     def finish(self):
         '''Called when the sender sends the `fin` packet. You don't need to do
         anything in particular here. You can use it to check that all
@@ -125,18 +329,24 @@ class Receiver:
         TCP handles this.
 
         '''
-        if self.segments_head:
+        if self.segments:
             print("Data unsent")
-            print(f"Start: {self.segments_head.start}")
+            print(f"Start: {self.segments[0].start}")
         else:
             print("All data sent")
         pass
 
 class Sender:
-    def __init__(self, data_len: int):
+    def __init__(self, data_len: int, payload_size: int = payload_size, cc: Optional[CongestionControl] = None,
+                 clock: Callable[[], float] = time.time, telemetry: Optional[Telemetry] = None):
         '''`data_len` is the length of the data we want to send. A real
         transport will not force the application to pre-commit to the
-        length of data, but we are ok with it.
+        length of data, but we are ok with it. `payload_size` is the
+        number of data bytes per packet, which depends on the wire
+        format in use. `cc` decides the congestion window (AIMD if not
+        given). `clock` returns the current time in seconds; the link
+        emulator passes its virtual clock. If `telemetry` is given, every
+        send, ACK, loss and timeout is recorded in it as SENDER_FIELDS.
 
         '''
         # TODO: Initialize any variables you want here, for instance a
@@ -144,8 +354,15 @@ class Sender:
         # sent, acknowledged, detected to be lost or retransmitted
         self.min_adj_ack = 0
         self.next_adj_send_idx = 0
+        self.clock = clock
         self.data_len = data_len
-        self.acked_packets = [False] * (data_len // payload_size + 1)
+        self.payload_size = payload_size
+        self.acked_packets = PacketBitmap(-(-data_len // self.payload_size))
+        # Byte ranges already ACKed, so repeated SACK ranges cost nothing
+        self.scoreboard = SackScoreboard()
+        # End of the receiver's advertised window: new data must not go
+        # past it. None until the receiver advertises one.
+        self.window_end: Optional[int] = None
 
         # ~=====~ For Congestion Control ~=====~
         # Note: RTT and RTO is measured in seconds!
@@ -155,25 +372,65 @@ class Sender:
         # EWMA constants (classic TCP)
         self.alpha = 1.0 / 8.0 # For `rtt_avg`
         self.beta = 1.0 / 4.0 # For `rtt_var`
-        # Send timestamp mapping (packet_id -> send_time)
+        # Send timestamp mapping (packet_id -> send_time), only needed for
+        # receivers that do not echo timestamps
         self.send_times: Dict[int, float] = {}
-        # Congestion control state (bytes)
-        self.cwnd = packet_size            # Start with 1 MSS
-        self.ssthresh = 64 * 1024           # Initial ssthresh (64KB)
+        self.echoes = False
+        # Recent samples, for the minimum and percentiles of the RTT
+        self.rtt_window = RttWindow()
+        # Congestion controller, which owns `cwnd` and `ssthresh` (bytes)
+        self.cc = cc if cc is not None else Aimd(packet_size)
+
+        # ~=====~ For Loss Recovery ~=====~
+        # Packets in flight (adj_idx -> (last send time, packet_id)),
+        # oldest send first
+        self.in_flight: Dict[int, Tuple[float, int]] = {}
+        self.in_flight_bytes = 0
+        # Packets detected as lost, retransmitted before any new data
+        self.lost: Deque[int] = deque()
+        # The `packet_id`s of the `dup_thresh` latest sent packets that were
+        # ACKed. Anything still in flight that was sent before the earliest
+        # of them has been overtaken by enough packets to be considered
+        # lost.
+        self.top_acked: List[int] = []
+        # RACK: send time, RTT and `packet_id` of the most recently sent
+        # packet ACKed
+        self.rack_xmit = 0.0
+        self.rack_rtt = 0.0
+        self.rack_id = -1
+        # With FEC, the packet ids a packet's parity may follow it by.
+        # Losses are only declared once packets sent after the parity were
+        # ACKed, so the receiver gets the chance to rebuild them first.
+        self.fec_slack = 0
+        # While recovering from a loss, the first packet sent after it was
+        # detected. Recovery ends when everything before it is ACKed.
+        self.recovery_point: Optional[int] = None
+        self.retransmits = 0
+        self.timeouts = 0
+        self.telemetry = telemetry
 
     def timeout(self):
         '''Called when the sender times out.'''
         # TODO: In addition to what you did in assignment 1, set cwnd to 1
         # packet
         self.next_adj_send_idx = self.min_adj_ack
+        # Everything in flight is retransmitted from `min_adj_ack` on
+        self.in_flight.clear()
+        self.in_flight_bytes = 0
+        self.lost.clear()
+        self.recovery_point = None
+        self.timeouts += 1
 
         # ~=====~ For Congestion Control ~=====~
-        self.cwnd = max(self.cwnd / 2.0, packet_size)
-        self.ssthresh = max(self.cwnd, packet_size)
-        # We will retransmit from earliest un-acked packet, so old timestamps are now stale
+        self.cc.on_timeout(self.clock())
+        # Packets sent before the timeout will mostly never be ACKed.
+        # Timestamp echoes keep RTT sampling going for the retransmissions.
         self.send_times.clear()
+        if self.telemetry is not None:
+            self.record(TIMEOUT, self.clock())
 
-    def ack_packet(self, sacks: List[Tuple[int, int]], packet_id: int) -> int:
+    def ack_packet(self, sacks: List[Tuple[int, int]], packet_id: int, echo: Optional[float] = None,
+                   window: Optional[int] = None) -> int:
         '''Called every time we get an acknowledgment. The argument is a list
         of ranges of bytes that have been ACKed. Returns the number of
         payload bytes new that are no longer in flight, either because
@@ -183,22 +440,60 @@ class Sender:
         ACKed and another 500-byte is assumed lost, we will return
         600, even if 1000s of bytes have been ACKed before this.
 
+        `echo` is the send time of the packet that triggered the ACK, as
+        echoed by the receiver, and `window` the receiver's window past
+        the cumulative ACK, if it advertised one.
+
         '''
+        now = self.clock()
+        if window is not None and sacks:
+            self.window_end = sacks[0][1] + window
         ack_size = 0
+        # Bytes of newly ACKed packets that we were counting as in flight
+        released = 0
+        # Everything below `min_adj_ack` is known to be ACKed already
+        floor = self.min_adj_ack * self.payload_size
         for sack in sacks:
-            for idx in range(sack[0], sack[1], payload_size):
-                adj_idx = idx // payload_size
-                if not self.acked_packets[adj_idx]:
-                    self.acked_packets[adj_idx] = True
-                    ack_size += min(payload_size, self.data_len - idx)
-        while self.min_adj_ack < len(self.acked_packets) and self.acked_packets[self.min_adj_ack]:
-            self.min_adj_ack += 1
+            start = max(sack[0], floor)
+            end = min(sack[1], self.data_len)
+            # Only visit the packets in ranges we have not seen before
+            for new_start, new_end in self.scoreboard.add(start, end):
+                for adj_idx in range(new_start // self.payload_size, (new_end - 1) // self.payload_size + 1):
+                    if self.acked_packets.set(adj_idx):
+                        size = self.packet_bytes(adj_idx)
+                        ack_size += size
+                        sent = self.in_flight.pop(adj_idx, None)
+                        if sent is not None:
+                            released += size
+                            self.in_flight_bytes -= size
+                            xmit, sent_id = sent
+                            if xmit > self.rack_xmit:
+                                self.rack_xmit = xmit
+                                self.rack_rtt = now - xmit
+                                self.rack_id = sent_id
+                            # Packets sent in one compressed payload share
+                            # their packet_id and count once
+                            if sent_id not in self.top_acked and (len(self.top_acked) < dup_thresh or
+                                                                  sent_id > self.top_acked[0]):
+                                bisect.insort(self.top_acked, sent_id)
+                                if len(self.top_acked) > dup_thresh:
+                                    self.top_acked.pop(0)
+        self.min_adj_ack = self.acked_packets.find_next_clear(self.min_adj_ack)
 
         # ~=====~ For Congestion Control ~=====~
-        # If we have a send timestamp for this packet_id, compute RTT and update EWMA
-        now = time.time()
-        if packet_id in self.send_times:
-            send_time = self.send_times.pop(packet_id)
+        # The echoed timestamp is that of the transmission that arrived,
+        # so unlike a timestamp looked up by sequence number it is valid
+        # for retransmissions too (no need for Karn's algorithm). Without
+        # it, fall back to the send time of this packet_id.
+        send_time = echo
+        rtt = math.nan
+        if echo is not None:
+            if not self.echoes:
+                self.echoes = True
+                self.send_times.clear()
+        else:
+            send_time = self.send_times.pop(packet_id, None)
+        if send_time is not None:
             rtt = now - send_time
             # First measurement initialization
             if self.rtt_avg is None:
@@ -209,24 +504,69 @@ class Sender:
                 err = abs(rtt - self.rtt_avg)
                 self.rtt_avg = (1 - self.alpha) * self.rtt_avg + self.alpha * rtt
                 self.rtt_var = (1 - self.beta) * self.rtt_var + self.beta * err
-        
-        # Congestion window update (AIMD)
-        # We only increase `cwnd`` when new bytes are acknowledged (`ack_size` > 0)
+            self.rtt_window.add(rtt, now)
+            self.cc.rtt_sample(rtt, now)
+
+        # ~=====~ For Loss Recovery ~=====~
+        lost = self.detect_losses(now)
+        if self.recovery_point is not None and self.min_adj_ack >= self.recovery_point:
+            self.recovery_point = None
+        if lost > 0 and self.recovery_point is None:
+            # Only one window reduction per loss episode
+            self.recovery_point = self.next_adj_send_idx
+            self.cc.on_loss(lost, now)
+
+        # Congestion window update
+        # We only grow `cwnd` when new bytes are acknowledged (`ack_size` > 0)
         if ack_size > 0:
-            # Slow start
-            if self.cwnd < self.ssthresh:
-                # Increase by approximately one MSS per ACKed packet
-                self.cwnd += ack_size
+            self.cc.on_ack(ack_size, now)
+        if self.telemetry is not None:
+            if lost > 0:
+                self.record(LOSS, now)
+            self.record(ACK, now, rtt, len(sacks) - 1)
+        return released + lost
+
+    def detect_losses(self, now: float) -> int:
+        '''Marks packets in flight as lost and queues them for
+        retransmission. Returns the number of bytes marked.
+
+        A packet is lost if `dup_thresh` packets sent after it were ACKed
+        (RFC 6675), or if a packet sent after it was ACKed and it has been
+        out for longer than that packet's RTT plus a reordering window
+        (RACK). The latter also catches lost retransmissions and losses
+        at the tail of the window. Packets are checked oldest send first,
+        stopping at the first that is not lost. Either way, the packet ACKed
+        must have been sent more than `fec_slack` ids after it.
+
+        '''
+        sack_lost_below = self.top_acked[0] - self.fec_slack if len(self.top_acked) >= dup_thresh else -1
+        rack_lost_below = self.rack_id - self.fec_slack
+        reo_wnd = (self.rtt_window.min_rtt or 0.0) * rack_reo_fraction
+        lost: List[int] = []
+        for adj_idx, (xmit, sent_id) in self.in_flight.items():
+            if sent_id < sack_lost_below or (xmit < self.rack_xmit and now - xmit >= self.rack_rtt + reo_wnd and
+                                             sent_id < rack_lost_below):
+                lost.append(adj_idx)
             else:
-                # Using the formula: add (ack_bytes * MSS) / cwnd_bytes
-                # Yields ~1*MSS increase per RTT
-                self.cwnd += ack_size * packet_size / max(1.0, self.cwnd)
-        return ack_size
+                break
+        lost_bytes = 0
+        for adj_idx in lost:
+            _, packet_id = self.in_flight.pop(adj_idx)
+            # It will not be ACKed, so stop tracking its send time
+            self.send_times.pop(packet_id, None)
+            self.lost.append(adj_idx)
+            lost_bytes += self.packet_bytes(adj_idx)
+        self.in_flight_bytes -= lost_bytes
+        return lost_bytes
+
+    def packet_bytes(self, adj_idx: int) -> int:
+        return min(self.payload_size, self.data_len - adj_idx * self.payload_size)
 
     def send(self, packet_id: int) -> Optional[Tuple[int, int]]:
         '''Called just before we are going to send a data packet. Should
         return the range of sequence numbers we should send. If there
-        are no more bytes to send, returns a zero range (i.e. the two
+        are no more bytes to send, or the receiver's window has no room
+        for the next packet, returns a zero range (i.e. the two
         elements of the tuple are equal). Return None if there are no
         more bytes to send, and _all_ bytes have been
         acknowledged. Note: The range should not be larger than
@@ -237,30 +577,104 @@ class Sender:
         if self.min_adj_ack >= len(self.acked_packets):
             return None
 
-        while self.next_adj_send_idx < len(self.acked_packets) and self.acked_packets[self.next_adj_send_idx]:
-            self.next_adj_send_idx += 1
+        # Retransmit packets detected as lost first
+        while self.lost:
+            adj_idx = self.lost.popleft()
+            if not self.acked_packets[adj_idx]:
+                self.retransmits += 1
+                return self.transmit(adj_idx, packet_id)
+
+        self.next_adj_send_idx = self.acked_packets.find_next_clear(self.next_adj_send_idx)
 
         if self.next_adj_send_idx >= len(self.acked_packets):
             return (self.data_len, self.data_len)
-        
-        start = self.next_adj_send_idx * payload_size
-        end = min((self.next_adj_send_idx + 1) * payload_size, self.data_len)
+        if self.window_end is not None and (self.next_adj_send_idx * self.payload_size +
+                                            self.packet_bytes(self.next_adj_send_idx) > self.window_end):
+            # The receiver's window is full until it ACKs more
+            return (self.data_len, self.data_len)
+
+        adj_idx = self.next_adj_send_idx
         self.next_adj_send_idx += 1
+        return self.transmit(adj_idx, packet_id)
+
+    def new_run(self, start: int, max_bytes: int) -> List[int]:
+        '''The ends of the packets that the next calls to `send` will
+        return if they are new data continuing exactly at byte `start`,
+        as many as fit in `max_bytes`. Empty if a retransmission comes
+        first. Used to put several packets in one compressed payload.'''
+        if self.lost or start % self.payload_size:
+            return []
+        adj_idx = start // self.payload_size
+        if self.acked_packets.find_next_clear(self.next_adj_send_idx) != adj_idx:
+            return []
+        if self.window_end is not None:
+            max_bytes = min(max_bytes, self.window_end - start)
+        ends: List[int] = []
+        end = start
+        while adj_idx < len(self.acked_packets) and not self.acked_packets[adj_idx]:
+            end += self.packet_bytes(adj_idx)
+            if end - start > max_bytes:
+                break
+            ends.append(end)
+            adj_idx += 1
+        return ends
+
+    def transmit(self, adj_idx: int, packet_id: int) -> Tuple[int, int]:
+        now = self.clock()
+        # Move the packet to the end of the send order
+        if self.in_flight.pop(adj_idx, None) is None:
+            self.in_flight_bytes += self.packet_bytes(adj_idx)
+        self.in_flight[adj_idx] = (now, packet_id)
 
         # ~=====~ For Congestion Control ~=====~
         # Record send time for this packet_id so we can compute RTT when acked
-        self.send_times[packet_id] = time.time()
+        if not self.echoes:
+            self.send_times[packet_id] = now
+
+        if self.telemetry is not None:
+            self.record(SEND, now)
+        start = adj_idx * self.payload_size
+        return (start, start + self.packet_bytes(adj_idx))
 
-        return (start, end)
+    def record(self, kind: int, now: float, rtt: float = math.nan, sack_blocks: float = math.nan):
+        telemetry = self.telemetry
+        slot = telemetry.slot(kind)
+        t, cwnd, ssthresh, inflight, rtt_column, rto, retransmits, timeouts, blocks = telemetry.columns
+        t[slot] = now
+        cwnd[slot] = self.cc.cwnd
+        ssthresh[slot] = self.cc.ssthresh
+        inflight[slot] = self.in_flight_bytes
+        rtt_column[slot] = rtt
+        rto[slot] = self.get_rto()
+        retransmits[slot] = self.retransmits
+        timeouts[slot] = self.timeouts
+        blocks[slot] = sack_blocks
 
 
     def get_cwnd(self) -> int:
         '''
-            `self.cwnd` is always an `int` in traditional AIMD since we use `//` integer division
-            However, in the case we extend the CC to implement TCP Vegas, `cwnd` can evolve via
-            floating-point math internally, we would want to floor `self.cwnd`
+            Controllers such as Vegas and CUBIC evolve `cwnd` via
+            floating-point math internally, so we floor it
         '''
-        return int(self.cwnd)
+        return int(self.cc.cwnd)
+
+    def pacing_rate(self) -> Optional[float]:
+        '''The rate, in bytes per second, to pace packets at when pacing is
+        on, as chosen by the congestion controller. None until it has
+        enough measurements.
+        '''
+        return self.cc.pacing_rate(self.rtt_avg)
+
+    def stats(self) -> Dict[str, float]:
+        '''Retransmissions, and the minimum, median and 99th percentile
+        RTT (in milliseconds) over the recent RTT window.'''
+        stats: Dict[str, float] = {"retransmits": self.retransmits}
+        for name, value in (("rtt_min_ms", self.rtt_window.min_rtt),
+                            ("rtt_p50_ms", self.rtt_window.percentile(50)),
+                            ("rtt_p99_ms", self.rtt_window.percentile(99))):
+            if value is not None:
+                stats[name] = value * 1000.0
+        return stats
 
     def get_rto(self) -> float:
         if self.rtt_avg is None or self.rtt_var is None: return 1.0
@@ -271,7 +685,290 @@ class Sender:
             rto = 0.005
         return rto
 
-def start_receiver(ip: str, port: int):
+class ConnectionStats:
+    '''Counters for one connection, kept by `ReceiverServer`.'''
+    def __init__(self):
+        self.start = time.time()
+        self.last = self.start
+        self.packets = 0
+        self.payload_bytes = 0
+        self.delivered_bytes = 0
+        self.acks = 0
+
+    def as_dict(self) -> Dict[str, float]:
+        duration = max(self.last - self.start, 1e-9)
+        return {"packets": self.packets, "payload_bytes": self.payload_bytes,
+                "delivered_bytes": self.delivered_bytes, "acks": self.acks,
+                "duration": duration, "goodput": self.delivered_bytes / duration}
+
+def format_stats(stats: Dict[str, float]) -> str:
+    return " ".join(f"{k}={v}" if isinstance(v, int) else f"{k}={v:.3f}" for k, v in stats.items())
+
+class ReceiverServer:
+    '''Serves every sender that talks to one UDP socket.
+
+    The loop is event driven: it waits on a `selectors` selector and, on
+    each wakeup, drains every queued datagram (up to `max_batch`) without
+    blocking, then sends all the resulting ACKs together. A connection
+    whose packets take long to process therefore delays the others by at
+    most one batch instead of one packet each.
+
+    Each connection buffers at most `recv_budget` bytes past its
+    cumulative ACK, and all of them together `global_recv_budget`: once
+    there are too many connections for every one to get `recv_budget`,
+    each gets an equal share (but at least `min_recv_window`). The window
+    is re-shared as connections open and close, and advertised in every
+    ACK, so receiver memory stays bounded however many senders there are
+    and however fast they send.
+
+    '''
+    # Datagrams handled per wakeup before the queued ACKs are sent
+    max_batch = 256
+
+    def __init__(self, server_socket: socket.socket, max_sack_blocks: int = max_sack_blocks,
+                 sack_bitmap: bool = False, outdir: Optional[str] = None, batch_io: bool = False,
+                 telemetry: Optional[str] = None, telemetry_size: int = default_capacity,
+                 profiler: Optional[Profiler] = None, recv_budget: int = recv_budget,
+                 global_recv_budget: int = global_recv_budget):
+        self.socket = server_socket
+        self.socket.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.socket, selectors.EVENT_READ)
+        # With `batch_io`, datagrams are read with UDP GRO and ACKs sent
+        # with UDP GSO where the kernel supports it
+        self.reader = BatchReader(self.socket, gro=batch_io)
+        self.writer = BatchSender(self.socket, gso=batch_io)
+        self.max_sack_blocks = max_sack_blocks
+        self.sack_bitmap = sack_bitmap
+        self.outdir = outdir
+        # Directory each connection's telemetry is written to at `fin`
+        self.telemetry = telemetry
+        if telemetry:
+            os.makedirs(telemetry, exist_ok=True)
+        self.telemetry_size = telemetry_size
+        # With `--profile`, reported at every `fin`
+        self.profiler = profiler
+        self.phases = profiler.phases if profiler is not None else None
+        self.recv_budget = recv_budget
+        self.global_recv_budget = global_recv_budget
+        # Window every open connection currently has
+        self.shared_window = self.window(1)
+
+        self.receivers: Dict[Any, Receiver] = {}
+        self.sinks: Dict[Any, FileSink] = {}
+        self.stats: Dict[Any, ConnectionStats] = {}
+        # Totals of connections that already finished
+        self.finished = ConnectionStats()
+        self.finished_count = 0
+        self.malformed = 0
+
+    def serve_forever(self, stats_interval: Optional[float] = None,
+                      report: Optional[Callable[[Dict[str, float]], None]] = None):
+        '''Runs the receive loop. Every `stats_interval` seconds, passes the
+        aggregate statistics to `report`, which prints them by default.
+        When the loop is interrupted, the telemetry of the connections
+        still open is written out.'''
+        next_report = time.time() + stats_interval if stats_interval else None
+        phases = self.phases
+        try:
+            while True:
+                timeout = max(0.0, next_report - time.time()) if next_report else None
+                if phases is not None:
+                    t = time.perf_counter()
+                ready = self.selector.select(timeout)
+                if phases is not None:
+                    phases.add(IDLE, t)
+                if ready:
+                    self.send_acks(self.drain())
+                if next_report and time.time() >= next_report:
+                    if report is None:
+                        print(format_stats(self.summary()))
+                    else:
+                        report(self.summary())
+                    next_report += stats_interval
+        finally:
+            # The fin is sent once and may be lost, so a connection may
+            # never close
+            for addr, receiver in self.receivers.items():
+                self.dump_telemetry(addr, receiver)
+
+    def drain(self) -> List[Tuple[bytes, Any]]:
+        '''Handles queued datagrams until none are left or `max_batch`
+        were read. Returns the ACKs to send.'''
+        acks: List[Tuple[bytes, Any]] = []
+        if self.phases is not None:
+            t = time.perf_counter()
+        datagrams = self.reader.read_batch(self.max_batch)
+        if self.phases is not None:
+            self.phases.add(SYSCALLS, t)
+        for data, addr in datagrams:
+            ack = self.handle(data, addr)
+            if ack is not None:
+                acks.append((ack, addr))
+        return acks
+
+    def send_acks(self, acks: List[Tuple[bytes, Any]]):
+        # If the socket buffer is full, ACKs are dropped like any UDP
+        # packet; later ACKs carry the same information
+        if self.phases is not None:
+            t = time.perf_counter()
+        for ack, addr in acks:
+            self.writer.add(ack, addr)
+        self.writer.flush()
+        if self.phases is not None:
+            self.phases.add(SYSCALLS, t)
+
+    def handle(self, data: bytes, addr) -> Optional[bytes]:
+        '''Processes one datagram from `addr` and returns the ACK to send
+        back, if any.'''
+        # print(f"DEBUG - Received packet: data: {data} form address {addr}")
+        # Packets arrive either as JSON or in the binary format
+        # (see wire.py). `decode` performs the format checks and
+        # always hands back the payload as bytes.
+        phases = self.phases
+        if phases is not None:
+            t = time.perf_counter()
+        try:
+            received = wire.decode(data)
+        except (ValueError, AssertionError, KeyError, TypeError, IndexError, struct.error):
+            # One bad packet must not take down every other connection
+            self.malformed += 1
+            return None
+        if phases is not None:
+            t = phases.add(DECODE, t)
+        if received.get("type") not in ("data", "parity", "fin"):
+            # Before any connection state exists for it
+            self.malformed += 1
+            return None
+
+        if addr not in self.receivers:
+            recorder = Telemetry(RECEIVER_FIELDS, self.telemetry_size) if self.telemetry else None
+            self.receivers[addr] = Receiver(self.max_sack_blocks, recorder, self.window(len(self.receivers) + 1))
+            self.stats[addr] = ConnectionStats()
+            self.share_windows()
+        receiver = self.receivers[addr]
+        stats = self.stats[addr]
+        stats.last = time.time()
+
+        if received["type"] == "data" or received["type"] == "parity":
+            stats.packets += 1
+            if phases is not None:
+                t = time.perf_counter()
+            if received["type"] == "data":
+                stats.payload_bytes += len(received["payload"])
+                sacks, app_data = receiver.data_packet(received["seq"], received["payload"],
+                                                       received["id"] if received.get("fec") else None)
+            else:
+                sacks, app_data = receiver.parity_packet(received["id"], received["count"], received["start_len"],
+                                                         received["payload"])
+            if phases is not None:
+                t = phases.add(REASSEMBLY, t)
+            stats.delivered_bytes = receiver.app_sent_index
+            # Note: we immediately write the data to file. A striped
+            # flow's sink is opened by its first data packet, which names
+            # the stripe: data rebuilt from parity, which does not, may be
+            # the first delivered.
+            if self.outdir is not None and (app_data or received.get("stripe") is not None):
+                sink = self.sink_for(addr, received.get("stripe"))
+                if app_data:
+                    sink.write(app_data)
+                    if phases is not None:
+                        t = phases.add(WRITE, t)
+
+            # ACK in the same format the data arrived in
+            stats.acks += 1
+            bitmap = receiver.sack_bitmap(wire.MAX_SACK_BITMAP_BITS) if self.sack_bitmap else None
+            ack = wire.encode_ack(received["wire"], sacks, received["id"], received.get("offer_binary", False), bitmap,
+                                  received.get("ts"), received.get("offer_compress", False),
+                                  received.get("offer_fec", False), receiver.window)
+            if phases is not None:
+                phases.add(ENCODE, t)
+            return ack
+
+        # The only other type left is "fin"
+        receiver.finish()
+        if self.outdir is not None:
+            self.sink_for(addr).close()
+            del self.sinks[addr]
+        self.close_connection(addr)
+        if self.profiler is not None:
+            self.profiler.report(summary=False)
+        return None
+
+    def sink_for(self, addr, stripe: Optional[wire.Stripe] = None) -> FileSink:
+        if addr not in self.sinks:
+            if stripe is None:
+                self.sinks[addr] = FileSink(os.path.join(self.outdir, f"{addr[0]}_{addr[1]}.recv"))
+            else:
+                # Each stripe writes its part of one file for the whole
+                # transfer. The last stripe ends the file, so it sets the
+                # file's length.
+                path = os.path.join(self.outdir, f"{addr[0]}_transfer{stripe.transfer}.recv")
+                self.sinks[addr] = FileSink(path, stripe.offset, stripe.index == stripe.count - 1)
+        return self.sinks[addr]
+
+    def window(self, connections: int) -> int:
+        '''The window of each of `connections` connections.'''
+        share = self.global_recv_budget // max(1, connections)
+        if share < self.recv_budget:
+            share = 1 << (share.bit_length() - 1) if share > 0 else 0
+        # The floor is for the share: a smaller `recv_budget` still holds
+        return min(self.recv_budget, max(min_recv_window, share))
+
+    def share_windows(self):
+        '''Gives every connection its share of the global budget. The
+        share only changes at powers of two, so this only walks the
+        connections when the number of them doubles or halves.'''
+        window = self.window(len(self.receivers))
+        if window == self.shared_window:
+            return
+        self.shared_window = window
+        for receiver in self.receivers.values():
+            receiver.set_window(window)
+
+    def dump_telemetry(self, addr, receiver: Receiver):
+        if receiver.telemetry is not None:
+            receiver.telemetry.dump(os.path.join(self.telemetry, f"{addr[0]}_{addr[1]}.tlm"))
+
+    def close_connection(self, addr):
+        stats = self.stats.pop(addr)
+        receiver = self.receivers.pop(addr)
+        self.share_windows()
+        self.dump_telemetry(addr, receiver)
+        line = format_stats(stats.as_dict())
+        if receiver.window_drops:
+            line += f" window_drops={receiver.window_drops}"
+        if receiver.fec is not None:
+            line += f" fec_recovered={receiver.fec.recovered}"
+        print(f"{addr[0]}:{addr[1]} {line}")
+        self.finished_count += 1
+        self.finished.packets += stats.packets
+        self.finished.payload_bytes += stats.payload_bytes
+        self.finished.delivered_bytes += stats.delivered_bytes
+        self.finished.acks += stats.acks
+
+    def connection_stats(self) -> Dict[str, Dict[str, float]]:
+        '''Statistics of every open connection, keyed by "host:port".'''
+        return {f"{addr[0]}:{addr[1]}": stats.as_dict() for addr, stats in self.stats.items()}
+
+    def summary(self) -> Dict[str, float]:
+        '''Totals over all connections, open or finished.'''
+        total = {"connections": len(self.stats), "finished": self.finished_count, "malformed": self.malformed,
+                 "buffer_bytes": sum(receiver.buffer.capacity for receiver in self.receivers.values()),
+                 "packets": self.finished.packets, "payload_bytes": self.finished.payload_bytes,
+                 "delivered_bytes": self.finished.delivered_bytes, "acks": self.finished.acks}
+        for stats in self.stats.values():
+            total["packets"] += stats.packets
+            total["payload_bytes"] += stats.payload_bytes
+            total["delivered_bytes"] += stats.delivered_bytes
+            total["acks"] += stats.acks
+        return total
+
+def start_receiver(ip: str, port: int, max_sack_blocks: int = max_sack_blocks, sack_bitmap: bool = False,
+                   outdir: Optional[str] = None, stats_interval: Optional[float] = None, workers: int = 1,
+                   batch_io: bool = False, telemetry: Optional[str] = None, telemetry_size: int = default_capacity,
+                   profile: Optional[str] = None, profile_out: Optional[str] = None, recv_budget: int = recv_budget,
+                   global_recv_budget: int = global_recv_budget):
     '''Starts a receiver thread. For each source address, we start a new
     `Receiver` class. When a `fin` packet is received, we call the
     `finish` function of that class.
@@ -300,59 +997,227 @@ def start_receiver(ip: str, port: int):
     really only emulate a network link in software that shuttles
     packets between different virtual interfaces.
 
+    Each ACK reports at most `max_sack_blocks` out-of-order ranges. With
+    `sack_bitmap`, it also carries a bitmap of the packets received past
+    the cumulative ACK, so the sender learns about every hole without
+    the ACK growing with their number.
+
+    If `outdir` is given, the data of each connection is written to
+    `<outdir>/<host>_<port>.recv`, named after the sender's address, and
+    synced to disk when its `fin` arrives. Otherwise it is discarded.
+
+    All connections are served by one event-driven `ReceiverServer`.
+    Statistics are printed for each connection at `fin`, and for all of
+    them every `stats_interval` seconds if it is given.
+
+    With `workers` > 1, see `start_receiver_workers`. With `batch_io`,
+    datagrams are read and ACKs sent in batches, see batchio.py.
+
+    If `telemetry` is given, every connection records its data packets
+    (see `Receiver.record`) and writes them to
+    `<telemetry>/<host>_<port>.tlm` at `fin`, or when the receiver is
+    stopped (Ctrl-C or SIGTERM) if the `fin` never came. The directory
+    is created if needed.
+
+    With `profile`, the receive loop's time per phase is printed at every
+    `fin`, as in `start_sender`. Under "cprofile", each `fin` also
+    rewrites `profile_out` with the stats so far.
+
+    Each connection buffers at most `recv_budget` bytes of out-of-order
+    data, and all of them `global_recv_budget` (see `ReceiverServer`).
+
     '''
 
-    receivers: Dict[str, Receiver] = {}
+    if workers > 1:
+        start_receiver_workers(ip, port, workers, max_sack_blocks, sack_bitmap, outdir, stats_interval, batch_io,
+                               telemetry, telemetry_size, profile, profile_out, recv_budget, global_recv_budget)
+        return
 
     with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server_socket:
         server_socket.bind((ip, port))
+        profiler = Profiler(profile, profile_out) if profile else None
+        server = ReceiverServer(server_socket, max_sack_blocks, sack_bitmap, outdir, batch_io, telemetry,
+                                telemetry_size, profiler, recv_budget, global_recv_budget)
+        # Make `kill` end the loop like Ctrl-C, so open connections'
+        # telemetry is still written
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        server.serve_forever(stats_interval)
 
-        while True:
-            data, addr = server_socket.recvfrom(packet_size)
-            if addr not in receivers:
-                receivers[addr] = Receiver()
-            # print(f"DEBUG - Received packet: data: {data} form address {addr}")
-            received = json.loads(data.decode())
-            if received["type"] == "data":
-                # Format check. Real code will have much more
-                # carefully designed checks to defend against
-                # attacks. Can you think of ways to exploit this
-                # transport layer and cause problems at the receiver?
-                # This is just for fun. It is not required as part of
-                # the assignment.
-                assert type(received["seq"]) is list
-                assert type(received["seq"][0]) is int and type(received["seq"][1]) is int
-                assert type(received["payload"]) is str
-                assert len(received["payload"]) <= payload_size
-
-                # Deserialize the packet. Real transport layers use
-                # more efficient and standardized ways of packing the
-                # data. One option is to use protobufs (look it up)
-                # instead of json. Protobufs can automatically design
-                # a byte structure given the data structure. However,
-                # for an internet standard, we usually want something
-                # more custom and hand-designed.
-                sacks, app_data = receivers[addr].data_packet(tuple(received["seq"]), received["payload"])
-                # Note: we immediately write the data to file
-                #receivers[addr][1].write(app_data)
-
-                # Send the ACK
-                server_socket.sendto(json.dumps({"type": "ack", "sacks": sacks, "id": received["id"]}).encode(), addr)
-
-
-            elif received["type"] == "fin":
-                receivers[addr].finish()
-                del receivers[addr]
+def run_receiver_worker(worker: int, ip: str, port: int, max_sack_blocks: int, sack_bitmap: bool,
+                        outdir: Optional[str], stats_interval: float, batch_io: bool, telemetry: Optional[str],
+                        telemetry_size: int, profile: Optional[str], profile_out: Optional[str], recv_budget: int,
+                        global_recv_budget: int, stats_queue: multiprocessing.Queue):
+    '''Body of one receiver worker process. Its socket shares the port
+    with the other workers, and its statistics go to the parent through
+    `stats_queue`. Its cProfile stats, if any, go to `profile_out` with
+    ".<worker>" added before the extension.'''
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server_socket:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server_socket.bind((ip, port))
+        if profile_out:
+            root, ext = os.path.splitext(profile_out)
+            profile_out = f"{root}.{worker}{ext}"
+        profiler = Profiler(profile, profile_out) if profile else None
+        server = ReceiverServer(server_socket, max_sack_blocks, sack_bitmap, outdir, batch_io, telemetry,
+                                telemetry_size, profiler, recv_budget, global_recv_budget)
+        # The parent stops workers with SIGTERM
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        server.serve_forever(stats_interval, lambda summary: stats_queue.put((worker, summary)))
 
-            else:
-                assert False
+def start_receiver_workers(ip: str, port: int, workers: int, max_sack_blocks: int = max_sack_blocks,
+                           sack_bitmap: bool = False, outdir: Optional[str] = None,
+                           stats_interval: Optional[float] = None, batch_io: bool = False,
+                           telemetry: Optional[str] = None, telemetry_size: int = default_capacity,
+                           profile: Optional[str] = None, profile_out: Optional[str] = None,
+                           recv_budget: int = recv_budget, global_recv_budget: int = global_recv_budget):
+    '''Runs `workers` receiver processes on the same port. Each binds its
+    own socket with `SO_REUSEPORT`, so the kernel hashes every sender's
+    address to one worker and each `Receiver` is only ever touched by
+    the process that owns it. Receive capacity then scales with cores.
+    The workers split `global_recv_budget` evenly.
 
-def start_sender(ip: str, port: int, data: str, recv_window: int, simloss: float):
-    sender = Sender(len(data))
+    This process only collects the workers' statistics and prints their
+    totals every `stats_interval` seconds (1 by default), along with the
+    number of packets each worker handled.
 
+    '''
+    stats_interval = stats_interval or 1.0
+    stats_queue: multiprocessing.Queue = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=run_receiver_worker, daemon=True,
+                                args=(worker, ip, port, max_sack_blocks, sack_bitmap, outdir, stats_interval,
+                                      batch_io, telemetry, telemetry_size, profile, profile_out, recv_budget,
+                                      global_recv_budget // workers, stats_queue))
+        for worker in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    # Make `kill` run the cleanup below instead of orphaning the workers
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    latest: Dict[int, Dict[str, float]] = {}
+    next_report = time.time() + stats_interval
+    try:
+        while all(process.is_alive() for process in processes):
+            try:
+                worker, summary = stats_queue.get(timeout=max(0.0, next_report - time.time()))
+                latest[worker] = summary
+            except queue.Empty:
+                pass
+            if time.time() >= next_report:
+                next_report += stats_interval
+                if not latest:
+                    continue
+                # Every worker reports running totals, so the latest
+                # report of each adds up to the overall totals
+                total = {key: sum(summary[key] for summary in latest.values()) for key in next(iter(latest.values()))}
+                per_worker = ",".join(str(latest[w]["packets"]) if w in latest else "-" for w in range(workers))
+                print(f"workers={workers} {format_stats(total)} worker_packets={per_worker}")
+        print("A receiver worker exited")
+    finally:
+        for process in processes:
+            process.terminate()
+        # Each writes the telemetry of its open connections on the way out
+        for process in processes:
+            process.join()
+
+def negotiate_wire(client_socket: socket.socket, attempts: int = 3, compress: bool = False,
+                   fec: bool = False) -> Tuple[str, bool, bool]:
+    '''Offers the binary wire format to the receiver by sending an empty
+    JSON data packet, and with `compress` compressed payloads and with
+    `fec` parity packets too. Returns the format both ends will use,
+    binary if the receiver's ACK echoes the offer and JSON otherwise
+    (including when no ACK comes back at all), whether payloads may be
+    compressed and whether parity may be sent.
+
+    '''
+    client_socket.settimeout(1.0)
+    for _ in range(attempts):
+        client_socket.send(wire.encode_probe(compress, fec))
+        try:
+            received = wire.decode(client_socket.recv(packet_size))
+        except socket.timeout:
+            continue
+        if received["type"] == "ack":
+            if not received.get("binary_ok"):
+                return wire.WIRE_JSON, False, False
+            return (wire.WIRE_BINARY, compress and received.get("compress_ok", False),
+                    fec and received.get("fec_ok", False))
+    return wire.WIRE_JSON, False, False
+
+def fill_packet(sender: Sender, data, seq: Tuple[int, int], packet_id: int, room: int,
+                packer: PayloadPacker) -> Tuple[Tuple[int, int], bytes, bool]:
+    '''Compresses the packet `seq` that `sender.send(packet_id)` just
+    returned together with as many of the new packets after it as fit
+    in one payload and in `room`, the bytes of window left beyond
+    `seq`. Those packets are taken from `sender` under the same
+    `packet_id`. Returns the range the payload covers, the payload, and
+    whether it is compressed.'''
+    ends = [seq[1]] + sender.new_run(seq[1], min(room, max_span - (seq[1] - seq[0])))
+    used, payload, compressed = packer.pack(data[seq[0]:ends[-1]], [end - seq[0] for end in ends])
+    end = seq[1]
+    while end < seq[0] + used:
+        extra = sender.send(packet_id)
+        assert extra is not None and extra[0] == end
+        end = extra[1]
+    return (seq[0], end), payload, compressed
+
+def start_sender(ip: str, port: int, data: FileSource, recv_window: int, simloss: float, wire_format: str = wire.WIRE_JSON,
+                 batch_io: bool = False, pacing: bool = False, cc: Optional[CongestionControl] = None,
+                 stripe: Optional[wire.Stripe] = None, telemetry: Optional[str] = None,
+                 telemetry_size: int = default_capacity, profile: Optional[str] = None,
+                 profile_out: Optional[str] = None, compress: bool = False, fec: bool = False):
+    '''Sends `data` to the receiver at `ip`:`port`. If `telemetry` is
+    given, the sender's events are recorded in a ring of `telemetry_size`
+    events and written to that file when the transfer ends, even if it
+    is interrupted (see `Telemetry.dump`).
+
+    With `profile` (see profiling.py), the time spent encoding, decoding,
+    processing ACKs, in system calls and waiting is counted, and printed
+    when the transfer ends. Under "cprofile" the whole transfer also runs
+    under cProfile, whose stats are written to `profile_out`.
+
+    With `compress` and the binary format, payloads are compressed if
+    the receiver supports it, each packing in as many packets as fit
+    (see `fill_packet`).
+
+    With `fec` and the binary format, a parity packet follows every group
+    of data packets if the receiver supports it, so it can rebuild one
+    lost packet per group without a retransmission (see fec.py).
+
+    '''
+    profiler = Profiler(profile, profile_out) if profile else None
+    phases = profiler.phases if profiler is not None else None
     with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client_socket:
         # So we can receive messages
         client_socket.connect((ip, port))
+
+        # JSON escapes most bytes of a file that is not text to six
+        # characters, so such files are sent in the binary format
+        text = wire.is_text(data) if wire_format == wire.WIRE_JSON else None
+        if text is False:
+            print("Not a text file, using --wire binary")
+            wire_format = wire.WIRE_BINARY
+        # Fall back to JSON if the receiver does not speak binary
+        compressed_ok = fec_ok = False
+        if wire_format == wire.WIRE_BINARY:
+            wire_format, compressed_ok, fec_ok = negotiate_wire(client_socket, compress=compress, fec=fec)
+        if wire_format == wire.WIRE_JSON and text is None:
+            text = wire.is_text(data)
+        recorder = Telemetry(SENDER_FIELDS, telemetry_size) if telemetry else None
+        sender = Sender(len(data), wire.max_payload(wire_format, packet_size, stripe is not None, text is not False),
+                        cc, telemetry=recorder)
+        # With `batch_io`, a whole window of packets is queued and sent
+        # with UDP GSO, and every queued ACK is read before sending again.
+        # Otherwise each packet and ACK takes its own system call.
+        outgoing = BatchSender(client_socket, gso=batch_io)
+        incoming = BatchReader(client_socket, gro=batch_io)
+        packer = PayloadPacker(sender.payload_size) if compressed_ok else None
+        encoder = FecEncoder() if fec_ok else None
+        # With `pacing`, packets leave at `sender.pacing_rate()` instead of
+        # in bursts as soon as the window allows
+        pacer = Pacer(pacing_burst * packet_size) if pacing else None
         # When waiting for packets when we call receivefrom, we
         # shouldn't wait more than 500ms
 
@@ -363,62 +1228,205 @@ def start_sender(ip: str, port: int, data: str, recv_window: int, simloss: float
         packet_id  = 0
         wait = False
 
-        while True:
-            # Get the congestion condow
-            cwnd = sender.get_cwnd()
-
-            # print(f"DEBUG - cwnd: {cwnd}, inflight: {inflight}, packet_size: {packet_size}, recv_window: {recv_window}, wait: {wait}")
-            # Do we have enough room in recv_window to send an entire
-            # packet?
-            if inflight + packet_size <= min(recv_window, cwnd) and not wait:
-                seq = sender.send(packet_id)
-                # print(f"DEBUG - Sending packet: {seq}")
-                if seq is None:
-                    # We are done sending
-                    client_socket.send('{"type": "fin"}'.encode())
-                    break
-                elif seq[1] == seq[0]:
-                    # No more packets to send until loss happens. Wait
-                    wait = True
-                    continue
+        try:
+            while True:
+                # Get the congestion condow
+                cwnd = sender.get_cwnd()
+                # How long the pacer still holds the next packet back
+                pacing_delay = 0.0
+                if pacer is not None:
+                    pacer.set_rate(sender.pacing_rate())
+                    pacing_delay = pacer.delay(packet_size)
+
+                # The receiver's advertised window, once it has sent one,
+                # is enforced by `sender.send`. Until then, and for
+                # receivers that advertise none, `recv_window` stands in.
+                window = cwnd if sender.window_end is not None else min(recv_window, cwnd)
+                # print(f"DEBUG - cwnd: {cwnd}, inflight: {inflight}, packet_size: {packet_size}, recv_window: {recv_window}, wait: {wait}")
+                # Do we have enough room in the window to send an entire
+                # packet?
+                window_open = inflight + packet_size <= window and not wait
+                if window_open and pacing_delay == 0.0:
+                    seq = sender.send(packet_id)
+                    # print(f"DEBUG - Sending packet: {seq}")
+                    if seq is None:
+                        # We are done sending
+                        outgoing.add(wire.encode_fin(wire_format))
+                        outgoing.flush()
+                        stats = {"stream": stripe.index, **sender.stats()} if stripe else sender.stats()
+                        if packer is not None:
+                            stats["compression"] = packer.ratio()
+                        if encoder is not None:
+                            stats["parity"] = encoder.parity_packets
+                            stats["fec_loss"] = encoder.loss
+                        print(format_stats(stats))
+                        break
+                    elif seq[1] == seq[0]:
+                        # No more packets to send until loss happens. Wait,
+                        # and protect the last packets of a partial group
+                        wait = True
+                        if encoder is not None:
+                            parity = encoder.flush()
+                            if parity is not None:
+                                if random.random() >= simloss:
+                                    outgoing.add(wire.encode_parity(packet_id, *parity, time.time()))
+                                packet_id += 1
+                        continue
 
-                assert seq[1] - seq[0] <= payload_size
-                assert seq[1] <= len(data)
+                    assert seq[1] - seq[0] <= sender.payload_size
+                    assert seq[1] <= len(data)
+
+                    if phases is not None:
+                        t = time.perf_counter()
+                    if packer is not None:
+                        room = window - inflight - (seq[1] - seq[0])
+                        seq, payload, compressed = fill_packet(sender, data, seq, packet_id, room, packer)
+                    else:
+                        payload, compressed = data[seq[0]:seq[1]], False
+
+                    # Simulate random loss before sending packets
+                    if random.random() < simloss:
+                        pass
+                    else:
+                        # Send the packet
+                        packet = wire.encode_data(wire_format, seq, packet_id, payload, time.time(), stripe, compressed,
+                                                  encoder is not None)
+                        if phases is not None:
+                            t = phases.add(ENCODE, t)
+                        outgoing.add(packet)
+                        if not batch_io:
+                            outgoing.flush()
+                            if phases is not None:
+                                t = phases.add(SYSCALLS, t)
+
+                    inflight += seq[1] - seq[0]
+                    packet_id += 1
+                    # Parity goes right after its group, and is lost like
+                    # any other packet. It is not counted in flight: the
+                    # window is about data.
+                    parity = None
+                    if encoder is not None:
+                        parity = encoder.add(seq[0], payload)
+                        sender.fec_slack = encoder.group_size()
+                    if parity is not None:
+                        if random.random() >= simloss:
+                            outgoing.add(wire.encode_parity(packet_id, *parity, time.time()))
+                            if not batch_io:
+                                outgoing.flush()
+                        packet_id += 1
+                        if phases is not None:
+                            phases.add(ENCODE, t)
+                    if pacer is not None:
+                        pacer.consume(packet_size)
 
-                # Simulate random loss before sending packets
-                if random.random() < simloss:
-                    pass
                 else:
-                    # Send the packet
-                    client_socket.send(
-                        json.dumps(
-                            {"type": "data", "seq": seq, "id": packet_id, "payload": data[seq[0]:seq[1]]}
-                        ).encode())
+                    wait = False
+                    # The window is full or the pacer holds the next packet
+                    # back: send what is queued
+                    if phases is not None:
+                        t = time.perf_counter()
+                    outgoing.flush()
+                    if phases is not None:
+                        t = phases.add(SYSCALLS, t)
+                    # Wait for ACKs. When pacing, only until the next packet
+                    # may go, and running out of time is not a loss. Waits too
+                    # short for the socket timeout poll for ACKs without
+                    # blocking, so the loop spins until the packet is due.
+                    paced = window_open
+                    block = not paced or pacing_delay >= spin_threshold
+                    try:
+                        rto = sender.get_rto()
+                        client_socket.settimeout(pacing_delay if paced else rto)
+                        # print(f"DEBUG - Setting timeout to {rto}")
+                        acks = incoming.read_batch(max_ack_batch if batch_io else 1, wait=block)
+                        if phases is not None:
+                            t = phases.add(IDLE if block else SYSCALLS, t)
+                        for received_bytes, _ in acks:
+                            received = wire.decode(received_bytes)
+                            assert received["type"] == "ack"
+                            if phases is not None:
+                                t = phases.add(DECODE, t)
 
-                inflight += seq[1] - seq[0]
-                packet_id += 1
+                            if random.random() < simloss:
+                                continue
+                            if encoder is not None:
+                                encoder.acked(received["id"])
 
-            else:
-                wait = False
-                # Wait for ACKs
-                try:
-                    rto = sender.get_rto()
-                    client_socket.settimeout(rto)
-                    # print(f"DEBUG - Setting timeout to {rto}")
-                    received_bytes = client_socket.recv(packet_size)
-                    received = json.loads(received_bytes.decode())
-                    assert received["type"] == "ack"
+                            # ACKs for packets sent before a timeout may arrive
+                            # after `inflight` was reset, so do not go below 0
+                            inflight = max(0, inflight - sender.ack_packet(received["sacks"], received["id"], received.get("echo"),
+                                                                           received.get("window")))
+                            if phases is not None:
+                                t = phases.add(SACK, t)
+                    except socket.timeout:
+                        if phases is not None:
+                            phases.add(IDLE, t)
+                        if paced:
+                            continue
+                        inflight = 0
+                        print("Timeout")
+                        sender.timeout()
+        finally:
+            if recorder is not None:
+                recorder.dump(telemetry)
+            if profiler is not None:
+                profiler.report()
 
-                    if random.random() < simloss:
-                        continue
+def run_sender_stream(ip: str, port: int, path: str, stripe: wire.Stripe, length: int, recv_window: int,
+                      simloss: float, wire_format: str, batch_io: bool, pacing: bool, cc: str, fixed_cwnd: int,
+                      telemetry: Optional[str], telemetry_size: int, profile: Optional[str],
+                      profile_out: Optional[str], compress: bool, fec: bool):
+    '''Body of one sender stream process: sends the `length` bytes of
+    `path` at `stripe.offset` as one flow. Its telemetry, if any, goes to
+    `telemetry` with ".<stream index>" added before the extension, and
+    likewise its cProfile stats to `profile_out`.'''
+    if telemetry:
+        root, ext = os.path.splitext(telemetry)
+        telemetry = f"{root}.{stripe.index}{ext}"
+    if profile_out:
+        root, ext = os.path.splitext(profile_out)
+        profile_out = f"{root}.{stripe.index}{ext}"
+    with FileSource(path) as data:
+        start_sender(ip, port, SourceRange(data, stripe.offset, length), recv_window, simloss, wire_format, batch_io,
+                     pacing, make_controller(cc, packet_size, fixed_cwnd), stripe, telemetry, telemetry_size, profile,
+                     profile_out, compress, fec)
 
-                    inflight -= sender.ack_packet(received["sacks"], received["id"])
-                    assert inflight >= 0
-                except socket.timeout:
-                    inflight = 0
-                    print("Timeout")
-                    sender.timeout()
+def start_sender_streams(ip: str, port: int, path: str, streams: int, recv_window: int, simloss: float,
+                         wire_format: str = wire.WIRE_JSON, batch_io: bool = False, pacing: bool = False,
+                         cc: str = CC_AIMD, fixed_cwnd: int = 200, telemetry: Optional[str] = None,
+                         telemetry_size: int = default_capacity, profile: Optional[str] = None,
+                         profile_out: Optional[str] = None, compress: bool = False, fec: bool = False):
+    '''Sends the file at `path` over `streams` concurrent flows.
 
+    The file is cut into `streams` contiguous stripes of (nearly) equal
+    size, and each is sent by its own process with its own socket,
+    `Sender` and congestion controller, so flows neither share a window
+    nor a Python interpreter. Every packet names its stripe (see
+    wire.py), and the receiver writes each stripe at its offset in one
+    output file. Prints the aggregate goodput once all flows are done.
+
+    '''
+    size = os.path.getsize(path)
+    streams = max(1, min(streams, size))
+    transfer = random.getrandbits(32)
+    bounds = [size * i // streams for i in range(streams + 1)]
+    processes = [
+        multiprocessing.Process(target=run_sender_stream,
+                                args=(ip, port, path, wire.Stripe(transfer, i, streams, bounds[i]),
+                                      bounds[i + 1] - bounds[i], recv_window, simloss, wire_format, batch_io, pacing,
+                                      cc, fixed_cwnd, telemetry, telemetry_size, profile, profile_out, compress,
+                                      fec))
+        for i in range(streams)
+    ]
+    start = time.time()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    duration = time.time() - start
+    failed = sum(1 for process in processes if process.exitcode != 0)
+    print(format_stats({"streams": streams, "bytes": size, "failed": failed, "duration": duration,
+                        "goodput": size / duration if duration > 0 else 0.0}))
 
 def main():
     parser = argparse.ArgumentParser(description="Transport assignment")
@@ -426,21 +1434,56 @@ def main():
     parser.add_argument("--ip", type=str, required=True, help="IP address to bind/connect to")
     parser.add_argument("--port", type=int, required=True, help="Port number to bind/connect to")
     parser.add_argument("--sendfile", type=str, required=False, help="If role=sender, the file that contains data to send")
-    parser.add_argument("--recv_window", type=int, default=15000000, help="Receive window size in bytes")
+    parser.add_argument("--recv_window", type=int, default=15000000, help="If role=sender, the receive window in bytes until the receiver advertises one. Receivers that predate advertising never do")
+    parser.add_argument("--recv_budget", type=int, default=recv_budget, help="If role=receiver, the most out-of-order bytes buffered per connection, advertised to the sender as its window")
+    parser.add_argument("--global_recv_budget", type=int, default=global_recv_budget, help="If role=receiver, the most bytes buffered over all connections. Each connection's window shrinks to its share when there are many")
     parser.add_argument("--simloss", type=float, default=0.0, help="Simulate packet loss. Provide the fraction of packets (0-1) that should be randomly dropped")
+    parser.add_argument("--max_sack_blocks", type=int, default=max_sack_blocks, help="If role=receiver, the maximum number of out-of-order ranges reported per ACK")
+    parser.add_argument("--sack_bitmap", action="store_true", help="If role=receiver, also report received packets as a bitmap relative to the cumulative ACK")
+    parser.add_argument("--outdir", type=str, required=False, help="If role=receiver, the directory to write received files to. Data is discarded if not given")
+    parser.add_argument("--stats_interval", type=float, required=False, help="If role=receiver, print aggregate statistics every this many seconds")
+    parser.add_argument("--workers", type=int, default=1, help="If role=receiver, the number of receiver processes sharing the port through SO_REUSEPORT")
+    parser.add_argument("--batch_io", action="store_true", help="Send and receive datagrams in batches, with UDP GSO/GRO where the kernel supports it")
+    parser.add_argument("--pacing", action="store_true", help="If role=sender, pace packets over the RTT instead of sending each window as a burst")
+    parser.add_argument("--wire", choices=wire.WIRE_FORMATS, default=wire.WIRE_JSON, help="If role=sender, the packet format to use. 'binary' is negotiated with the receiver and falls back to JSON")
+    parser.add_argument("--cc", choices=sorted(CONTROLLERS), default=CC_AIMD, help="If role=sender, the congestion control algorithm")
+    parser.add_argument("--fixed_cwnd", type=int, default=200, help="If role=sender and --cc fixed, the congestion window in packets")
+    parser.add_argument("--streams", type=int, default=1, help="If role=sender, stripe the file over this many concurrent flows, each in its own process")
+    parser.add_argument("--telemetry", type=str, required=False, help="Record per-packet telemetry. If role=sender, the file to write it to (JSON lines if it ends in .jsonl, binary otherwise); if role=receiver, the directory to write each connection's binary dump to")
+    parser.add_argument("--compress", action="store_true", help="If role=sender and --wire binary, compress each payload on its own and pack as many packets into it as fit, if the receiver supports it")
+    parser.add_argument("--fec", action="store_true", help="If role=sender and --wire binary, send XOR parity after each group of packets, sized to the observed loss rate, so the receiver can rebuild a lost packet without a retransmission, if it supports it. Not with --compress")
+    parser.add_argument("--profile", choices=PROFILE_MODES, required=False, help="Time the encode, decode, SACK/reassembly, system call and idle phases and print a breakdown at fin. 'cprofile' also runs under cProfile and writes the stats to --profile_out")
+    parser.add_argument("--profile_out", type=str, required=False, help="With --profile cprofile, the pstats file to write. Defaults to <role>.pstats")
+    parser.add_argument("--telemetry_size", type=int, default=default_capacity, help="Number of most recent events kept per connection by --telemetry")
 
     args = parser.parse_args()
+    profile_out = args.profile_out or f"{args.role}.pstats"
+
+    if args.fec and args.compress:
+        parser.error("--fec and --compress cannot be combined")
 
     if args.role == "receiver":
-        start_receiver(args.ip, args.port)
+        if args.workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+            parser.error("--workers needs SO_REUSEPORT, which this platform does not support")
+        start_receiver(args.ip, args.port, args.max_sack_blocks, args.sack_bitmap, args.outdir, args.stats_interval,
+                       args.workers, args.batch_io, args.telemetry, args.telemetry_size, args.profile, profile_out,
+                       args.recv_budget, args.global_recv_budget)
     else:
         if args.sendfile is None:
             print("No file to send")
             return
 
-        with open(args.sendfile, 'r') as f:
-            data = f.read()
-            start_sender(args.ip, args.port, data, args.recv_window, args.simloss)
+        if args.streams > 1:
+            start_sender_streams(args.ip, args.port, args.sendfile, args.streams, args.recv_window, args.simloss,
+                                 args.wire, args.batch_io, args.pacing, args.cc, args.fixed_cwnd, args.telemetry,
+                                 args.telemetry_size, args.profile, profile_out, args.compress, args.fec)
+            return
+
+        with FileSource(args.sendfile) as data:
+            start_sender(args.ip, args.port, data, args.recv_window, args.simloss, args.wire, args.batch_io,
+                         args.pacing, make_controller(args.cc, packet_size, args.fixed_cwnd), telemetry=args.telemetry,
+                         telemetry_size=args.telemetry_size, profile=args.profile, profile_out=profile_out,
+                         compress=args.compress, fec=args.fec)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,416 @@
+import base64
+import json
+import struct
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+
+from compress import COMPRESS_TAG, decompress
+from fec import FEC_TAG, max_group
+
+# Packet encodings shared by the sender and the receiver.
+#
+# Two formats exist on the wire:
+#
+# - "json": the original format, e.g. {"type": "data", "seq": [0, 1200],
+#   "id": 0, "payload": "..."}. Every peer understands it.
+# - "binary": a versioned, fixed-layout header followed by the raw payload
+#   bytes. It is only used once both ends have agreed on it (see below).
+#
+# Negotiation: a sender that wants the binary format first sends an empty
+# JSON data packet (seq [0, 0]) carrying `"wire": BINARY_TAG`. A receiver
+# that understands the binary format echoes the tag in its JSON ACK; older
+# receivers simply ACK without it and the sender stays on JSON. Receivers
+# always answer in the format of the packet they received, so a JSON-only
+# sender never sees a binary packet.
+#
+# ACKs list SACK ranges as [start, end) pairs, starting with the cumulative
+# range (0, app_sent_index). They may also carry a bitmap of the packets
+# received past the cumulative ACK ("bitmap" in JSON, FLAG_SACK_BITMAP in
+# binary). `decode` expands it back into ranges, so callers only ever see
+# the "sacks" list.
+#
+# Data packets may carry the sender's clock at transmission ("ts", in
+# seconds), which the receiver echoes back in the ACK ("echo"). Since the
+# echo names the very transmission that was received, it gives an RTT
+# sample even for retransmissions. JSON receivers that predate it ignore
+# "ts" and send no "echo".
+#
+# When one file is striped over several flows (`--streams`), each data
+# packet of a flow also names its stripe ("stripe" in JSON, FLAG_STRIPE in
+# binary): which transfer it belongs to, its index among how many stripes,
+# and the file offset it starts at. Sequence numbers stay relative to the
+# stripe, so each flow is an ordinary connection otherwise.
+#
+# Binary data payloads may be compressed (FLAG_COMPRESSED, see
+# compress.py). The sequence range is then that of the source bytes, which
+# may span several packets' worth, and `decode` hands back the inflated
+# bytes. Like the binary format itself, compression is offered in the
+# probe ("compress": COMPRESS_TAG) and only used if the receiver's ACK
+# echoes the tag, so receivers that predate it never see the flag.
+#
+# Forward error correction (fec.py) is negotiated the same way ("fec":
+# FEC_TAG). The sender then sets FLAG_FEC on its data packets and follows
+# groups of them with TYPE_PARITY packets, each the XOR of the group's
+# payloads. Receivers ACK parity packets like data packets.
+#
+# ACKs also advertise the receiver's window ("window" in JSON,
+# FLAG_WINDOW in binary): how many bytes past the cumulative ACK it will
+# buffer. In binary ACKs it takes the last 8 bytes, after everything
+# else, so senders that predate it parse the rest as before and ignore
+# it, as JSON senders ignore the unknown key.
+
+WIRE_JSON = "json"
+WIRE_BINARY = "binary"
+WIRE_FORMATS = (WIRE_JSON, WIRE_BINARY)
+
+# Capability advertised in the JSON handshake
+BINARY_TAG = "bin2"
+
+# First byte of every binary packet. JSON packets always start with '{'
+# (0x7B), so a single byte is enough to tell the formats apart.
+MAGIC = 0xB7
+VERSION = 2
+
+TYPE_DATA = 0
+TYPE_ACK = 1
+TYPE_FIN = 2
+TYPE_PARITY = 3
+
+# Flags of an ACK: a SACK bitmap follows the SACK blocks, and the
+# receiver's window ends the packet
+FLAG_SACK_BITMAP = 0x01
+FLAG_WINDOW = 0x02
+# Flags of a data packet: a stripe descriptor follows the header, the
+# payload is compressed, and the packet belongs to an FEC group
+FLAG_STRIPE = 0x01
+FLAG_COMPRESSED = 0x02
+FLAG_FEC = 0x04
+
+# magic, version, type, flags, packet id, seq start, seq end, timestamp
+_DATA_HEADER = struct.Struct("!BBBBqQQQ")
+# magic, version, type, flags, packet id, echoed timestamp, number of
+# SACK blocks
+_ACK_HEADER = struct.Struct("!BBBBqQH")
+# magic, version, type, flags
+_FIN_HEADER = struct.Struct("!BBBB")
+# magic, version, type, flags, packet id, XOR of the members' starts and
+# lengths, number of members, timestamp
+_PARITY_HEADER = struct.Struct("!BBBBqQHQ")
+# seq start, seq end
+_SACK_BLOCK = struct.Struct("!QQ")
+# bitmap unit in bytes, bitmap length in bytes
+_SACK_BITMAP = struct.Struct("!IH")
+# receiver window in bytes
+_WINDOW = struct.Struct("!Q")
+# transfer id, stripe index, stripe count, file offset of the stripe
+_STRIPE = struct.Struct("!QHHQ")
+
+DATA_HEADER_SIZE = _DATA_HEADER.size
+
+# Largest payload that fits in a JSON data packet of `packet_size` bytes.
+# The JSON framing costs roughly 300 bytes, so 1200 of 1500 is used. That
+# also leaves room for the odd newline or quote of text, which JSON
+# escapes to two characters.
+JSON_PAYLOAD_SIZE = 1200
+# Any other byte is escaped to "\u00XX", six characters
+JSON_ESCAPE_SIZE = 6
+# Bytes of text: printable ASCII, tabs and line breaks
+TEXT_BYTES = bytes(range(0x20, 0x7f)) + b"\t\n\r"
+# Bytes checked at once by `is_text`
+TEXT_CHUNK_SIZE = 1 << 20
+
+# Largest SACK bitmap an ACK carries. 512 bytes keep a JSON ACK (base64,
+# plus the SACK blocks) under 1500 bytes.
+MAX_SACK_BITMAP_BITS = 4096
+
+SackBitmap = Tuple[int, bytes]
+
+
+class Stripe(NamedTuple):
+    '''The part of a striped transfer that one flow carries.'''
+    transfer: int
+    index: int
+    count: int
+    offset: int
+
+
+# Binary timestamps are whole microseconds; 0 means there is none
+_TS_UNITS = 1000000
+
+Payload = Union[bytes, bytearray, memoryview, str]
+
+
+def max_payload(wire: str, packet_size: int, striped: bool = False, text: bool = True) -> int:
+    '''Number of payload bytes per packet for the given wire format, and
+    whether packets carry a stripe descriptor. JSON packets of data that
+    is not `text` (see `is_text`) get a payload small enough to fit even
+    if every byte is escaped.'''
+    if wire == WIRE_BINARY:
+        return packet_size - DATA_HEADER_SIZE - (_STRIPE.size if striped else 0)
+    if not text:
+        return min(JSON_PAYLOAD_SIZE // JSON_ESCAPE_SIZE, packet_size)
+    return min(JSON_PAYLOAD_SIZE, packet_size)
+
+
+def is_text(data) -> bool:
+    '''Whether every byte of `data` (anything that can be sliced into
+    bytes-like objects, like a `FileSource`) is in `TEXT_BYTES`.'''
+    for start in range(0, len(data), TEXT_CHUNK_SIZE):
+        if bytes(data[start:start + TEXT_CHUNK_SIZE]).translate(None, TEXT_BYTES):
+            return False
+    return True
+
+
+def is_binary(raw: bytes) -> bool:
+    return len(raw) > 0 and raw[0] == MAGIC
+
+
+def encode_data(wire: str, seq: Tuple[int, int], packet_id: int, payload: Payload,
+                ts: Optional[float] = None, stripe: Optional[Stripe] = None, compressed: bool = False,
+                fec: bool = False) -> bytes:
+    '''`ts` is the sender's clock (`time.time()`), for the receiver to
+    echo. `stripe` is given when the flow carries part of a striped
+    transfer. `compressed` marks a payload produced by
+    `compress.PayloadPacker`, and `fec` a packet covered by parity
+    packets; only the binary format carries either.'''
+    if wire == WIRE_BINARY:
+        if isinstance(payload, str):
+            payload = payload.encode("latin-1")
+        flags = (FLAG_STRIPE if stripe else 0) | (FLAG_COMPRESSED if compressed else 0) | (FLAG_FEC if fec else 0)
+        header = _DATA_HEADER.pack(MAGIC, VERSION, TYPE_DATA, flags, packet_id, seq[0], seq[1], _pack_ts(ts))
+        if stripe:
+            header += _STRIPE.pack(*stripe)
+        return header + payload
+    assert not compressed and not fec, "Only binary packets carry compressed payloads or FEC"
+    if not isinstance(payload, str):
+        # One character per byte, so lengths match the sequence numbers
+        payload = bytes(payload).decode("latin-1")
+    packet: Dict[str, Any] = {"type": "data", "seq": seq, "id": packet_id, "payload": payload}
+    if ts is not None:
+        packet["ts"] = ts
+    if stripe:
+        packet["stripe"] = list(stripe)
+    return json.dumps(packet).encode()
+
+
+def encode_parity(packet_id: int, count: int, start_len: int, payload: bytes, ts: Optional[float] = None) -> bytes:
+    '''Parity of the `count` packets before `packet_id` (see fec.py).
+    Binary only.'''
+    return _PARITY_HEADER.pack(MAGIC, VERSION, TYPE_PARITY, 0, packet_id, start_len, count, _pack_ts(ts)) + payload
+
+
+def encode_probe(compress: bool = False, fec: bool = False) -> bytes:
+    '''Empty JSON data packet advertising binary support, and with
+    `compress` and `fec` compressed payloads and parity packets too.
+    Older receivers treat it as a zero-length segment and ACK it.'''
+    probe: Dict[str, Any] = {"type": "data", "seq": [0, 0], "id": -1, "payload": "", "wire": BINARY_TAG}
+    if compress:
+        probe["compress"] = COMPRESS_TAG
+    if fec:
+        probe["fec"] = FEC_TAG
+    return json.dumps(probe).encode()
+
+
+def encode_ack(wire: str, sacks: List[Tuple[int, int]], packet_id: int, offer_binary: bool = False,
+               bitmap: Optional[SackBitmap] = None, echo: Optional[float] = None,
+               offer_compress: bool = False, offer_fec: bool = False, window: Optional[int] = None) -> bytes:
+    '''`bitmap` is an optional (unit, bits) pair as returned by
+    `Receiver.sack_bitmap`: bit `i` covers the `unit` bytes starting at
+    `sacks[0][1] + i * unit`. `echo` is the "ts" of the data packet
+    being ACKed, if it had one. `offer_binary`, `offer_compress` and
+    `offer_fec` answer a probe that offered them. `window` is the
+    receiver's window, in bytes past `sacks[0][1]`.'''
+    if wire == WIRE_BINARY:
+        flags = (FLAG_SACK_BITMAP if bitmap else 0) | (FLAG_WINDOW if window is not None else 0)
+        parts = [_ACK_HEADER.pack(MAGIC, VERSION, TYPE_ACK, flags, packet_id, _pack_ts(echo), len(sacks))]
+        for sack in sacks:
+            parts.append(_SACK_BLOCK.pack(sack[0], sack[1]))
+        if bitmap:
+            parts.append(_SACK_BITMAP.pack(bitmap[0], len(bitmap[1])))
+            parts.append(bitmap[1])
+        if window is not None:
+            parts.append(_WINDOW.pack(window))
+        return b"".join(parts)
+    ack: Dict[str, Any] = {"type": "ack", "sacks": sacks, "id": packet_id}
+    if offer_binary:
+        ack["wire"] = BINARY_TAG
+    if offer_compress:
+        ack["compress"] = COMPRESS_TAG
+    if offer_fec:
+        ack["fec"] = FEC_TAG
+    if bitmap:
+        ack["bitmap"] = {"unit": bitmap[0], "bits": base64.b64encode(bitmap[1]).decode()}
+    if echo is not None:
+        ack["echo"] = echo
+    if window is not None:
+        ack["window"] = window
+    return json.dumps(ack).encode()
+
+
+def encode_fin(wire: str) -> bytes:
+    if wire == WIRE_BINARY:
+        return _FIN_HEADER.pack(MAGIC, VERSION, TYPE_FIN, 0)
+    return '{"type": "fin"}'.encode()
+
+
+def decode(raw: bytes) -> Dict[str, Any]:
+    '''Decodes a packet in either format into the dictionary layout of the
+    JSON format. Data payloads are always returned as `bytes`. The
+    dictionary also carries "wire", the format the packet arrived in,
+    so that replies can use the same one.
+
+    '''
+    if is_binary(raw):
+        return _decode_binary(raw)
+    return _decode_json(raw)
+
+
+def _decode_json(raw: bytes) -> Dict[str, Any]:
+    received = json.loads(raw.decode())
+    if received["type"] == "data":
+        # Format check. Real code will have much more carefully designed
+        # checks to defend against attacks.
+        assert type(received["seq"]) is list
+        assert type(received["seq"][0]) is int and type(received["seq"][1]) is int
+        assert type(received["payload"]) is str
+        assert len(received["payload"]) <= JSON_PAYLOAD_SIZE
+        received["seq"] = (received["seq"][0], received["seq"][1])
+        received["payload"] = received["payload"].encode("latin-1")
+        # As in the binary format, the payload must be exactly the range
+        if received["seq"][0] < 0:
+            raise ValueError("Negative sequence number")
+        if received["seq"][1] - received["seq"][0] != len(received["payload"]):
+            raise ValueError("Payload length does not match sequence range")
+        # Echoed back in the ACK, and the FEC group key
+        if type(received.get("id")) is not int:
+            raise ValueError("Packet id is not an integer")
+        received["offer_binary"] = received.get("wire") == BINARY_TAG
+        received["offer_compress"] = received.get("compress") == COMPRESS_TAG
+        received["offer_fec"] = received.get("fec") == FEC_TAG
+        # As in the binary format, "fec" marks a packet covered by parity,
+        # which JSON packets never are
+        received["fec"] = False
+        received["ts"] = _check_ts(received.get("ts"))
+        if received.get("stripe") is not None:
+            assert type(received["stripe"]) is list and len(received["stripe"]) == 4
+            assert all(type(field) is int for field in received["stripe"])
+            received["stripe"] = Stripe(*received["stripe"])
+        else:
+            received["stripe"] = None
+    elif received["type"] == "parity":
+        # Only senders that negotiated the binary format send parity
+        raise ValueError("Parity packets are binary only")
+    elif received["type"] == "ack":
+        received["binary_ok"] = received.get("wire") == BINARY_TAG
+        received["compress_ok"] = received.get("compress") == COMPRESS_TAG
+        received["fec_ok"] = received.get("fec") == FEC_TAG
+        received["echo"] = _check_ts(received.get("echo"))
+        if received.get("window") is not None:
+            assert type(received["window"]) is int and received["window"] >= 0
+        else:
+            received["window"] = None
+        if "bitmap" in received:
+            bitmap = received.pop("bitmap")
+            received["sacks"] += bitmap_to_ranges(received["sacks"][0][1], bitmap["unit"],
+                                                  base64.b64decode(bitmap["bits"]))
+    received["wire"] = WIRE_JSON
+    return received
+
+
+def _need(raw: bytes, size: int, what: str):
+    # Every `unpack_from` is preceded by one of these, so a truncated
+    # packet is a ValueError like any other malformed one
+    if len(raw) < size:
+        raise ValueError(f"Truncated {what}")
+
+
+def _decode_binary(raw: bytes) -> Dict[str, Any]:
+    _need(raw, _FIN_HEADER.size, "packet")
+    _, version, ptype, _ = _FIN_HEADER.unpack_from(raw)
+    if version != VERSION:
+        raise ValueError(f"Unsupported wire version {version}")
+
+    if ptype == TYPE_DATA:
+        _need(raw, _DATA_HEADER.size, "data header")
+        _, _, _, flags, packet_id, start, end, ts = _DATA_HEADER.unpack_from(raw)
+        if end < start:
+            raise ValueError("Sequence range ends before it starts")
+        offset = DATA_HEADER_SIZE
+        stripe = None
+        if flags & FLAG_STRIPE:
+            _need(raw, offset + _STRIPE.size, "stripe")
+            stripe = Stripe(*_STRIPE.unpack_from(raw, offset))
+            offset += _STRIPE.size
+        payload = raw[offset:]
+        if flags & FLAG_COMPRESSED:
+            payload = decompress(payload, end - start)
+        elif end - start != len(payload):
+            raise ValueError("Payload length does not match sequence range")
+        return {"type": "data", "seq": (start, end), "id": packet_id, "payload": payload, "ts": _unpack_ts(ts),
+                "stripe": stripe, "fec": bool(flags & FLAG_FEC), "wire": WIRE_BINARY}
+
+    if ptype == TYPE_PARITY:
+        _need(raw, _PARITY_HEADER.size, "parity header")
+        _, _, _, _, packet_id, start_len, count, ts = _PARITY_HEADER.unpack_from(raw)
+        # The receiver looks at every id the parity covers
+        if count > max_group:
+            raise ValueError(f"Parity covers {count} packets, more than {max_group}")
+        return {"type": "parity", "id": packet_id, "count": count, "start_len": start_len,
+                "payload": raw[_PARITY_HEADER.size:], "ts": _unpack_ts(ts), "wire": WIRE_BINARY}
+
+    if ptype == TYPE_ACK:
+        _need(raw, _ACK_HEADER.size, "ACK header")
+        _, _, _, flags, packet_id, echo, count = _ACK_HEADER.unpack_from(raw)
+        offset = _ACK_HEADER.size
+        _need(raw, offset + count * _SACK_BLOCK.size, "SACK blocks")
+        sacks = [_SACK_BLOCK.unpack_from(raw, offset + i * _SACK_BLOCK.size) for i in range(count)]
+        offset += count * _SACK_BLOCK.size
+        if flags & FLAG_SACK_BITMAP and sacks:
+            _need(raw, offset + _SACK_BITMAP.size, "SACK bitmap")
+            unit, length = _SACK_BITMAP.unpack_from(raw, offset)
+            offset += _SACK_BITMAP.size
+            _need(raw, offset + length, "SACK bitmap")
+            sacks += bitmap_to_ranges(sacks[0][1], unit, raw[offset:offset + length])
+            offset += length
+        window = None
+        if flags & FLAG_WINDOW:
+            _need(raw, offset + _WINDOW.size, "window")
+            window = _WINDOW.unpack_from(raw, len(raw) - _WINDOW.size)[0]
+        return {"type": "ack", "sacks": sacks, "id": packet_id, "echo": _unpack_ts(echo), "window": window,
+                "wire": WIRE_BINARY}
+
+    if ptype == TYPE_FIN:
+        return {"type": "fin", "wire": WIRE_BINARY}
+
+    raise ValueError(f"Unknown packet type {ptype}")
+
+
+def bitmap_to_ranges(cumulative: int, unit: int, bitmap: bytes) -> List[Tuple[int, int]]:
+    '''Turns a SACK bitmap into one range per run of set bits.'''
+    ranges: List[Tuple[int, int]] = []
+    bits = int.from_bytes(bitmap, "little")
+    position = 0
+    while bits:
+        # Skip the run of zeros, then measure the run of ones
+        zeros = (bits & -bits).bit_length() - 1
+        bits >>= zeros
+        ones = (~bits & (bits + 1)).bit_length() - 1
+        bits >>= ones
+        start = cumulative + (position + zeros) * unit
+        ranges.append((start, start + ones * unit))
+        position += zeros + ones
+    return ranges
+
+
+def _pack_ts(ts: Optional[float]) -> int:
+    return 0 if ts is None else int(ts * _TS_UNITS)
+
+
+def _unpack_ts(value: int) -> Optional[float]:
+    return None if value == 0 else value / _TS_UNITS
+
+
+def _check_ts(ts: Any) -> Optional[float]:
+    if ts is None:
+        return None
+    assert type(ts) in (int, float)
+    return float(ts)